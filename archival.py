@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""archival.py
+
+Archival of conferences that have ended.
+
+Archived conferences and their sessions keep all their data but carry
+archived=True, which the hot queries (queryConferences, the
+announcement, speaker and session searches) filter out unless the
+request sets includeArchived.
+
+Entities written before archived existed lack the property, and a
+filter on it would hide them until the 'archived' deploy migration (see
+mapper.MIGRATIONS) has stored it everywhere. Until then, onlyUnarchived()
+leaves queries unfiltered and dropArchived() removes archived entities
+from the results instead.
+
+"""
+
+from datetime import date
+
+from google.appengine.ext import ndb
+
+from caches import conferenceChanged
+from mapper import migrationDone
+from models import Conference
+from models import Session
+
+ARCHIVE_BATCH_SIZE = 50
+
+
+def archivedBackfilled():
+    """Return whether every conference and session stores archived."""
+    return migrationDone('archived')
+
+
+def onlyUnarchived(q, model):
+    """Return q restricted to the unarchived entities of model, if it
+    can be filtered on archived yet."""
+    if archivedBackfilled():
+        return q.filter(model.archived == False)
+    return q
+
+
+def dropArchived(entities):
+    """Return entities without the archived ones."""
+    return [entity for entity in entities if not entity.archived]
+
+
+def archiveEndedConferences(batch_size=ARCHIVE_BATCH_SIZE):
+    """Archive up to batch_size ended conferences and their sessions.
+
+    Returns (number archived, whether more may be left). Sessions are
+    marked before their conference, so an interrupted run is simply
+    repeated for that conference next time.
+    """
+    c_keys = Conference.query(Conference.archived == False,
+                              Conference.endDate < date.today()
+                              ).fetch(batch_size, keys_only=True)
+    for c_key in c_keys:
+        _archiveSessions(c_key)
+        _archiveConference(c_key)
+        conferenceChanged(c_key.urlsafe(), set(['archived']))
+    return len(c_keys), len(c_keys) == batch_size
+
+
+@ndb.transactional()
+def _archiveSessions(c_key):
+    # sessions hang off the conference id (see _createSessionObject)
+    sessions = Session.query(ancestor=ndb.Key(Conference, c_key.id())).fetch()
+    for sess in sessions:
+        sess.archived = True
+    ndb.put_multi(sessions)
+
+
+@ndb.transactional()
+def _archiveConference(c_key):
+    # re-read, so registrations since the query are not overwritten
+    conf = c_key.get()
+    if conf:
+        conf.archived = True
+        conf.put()
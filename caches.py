@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+"""caches.py
+
+Announcement, featured speaker and upcoming conference caches.
+
+Shared by the endpoints API and the task/cron handlers in main.py, so the
+handlers do not have to import (and build) the whole endpoints service.
+Values live in memcache and are recomputed on demand through coalesce.py,
+so a miss is refilled by a single request instead of every concurrent
+one. The announcement is also fronted by a short-lived in-instance copy
+that the warmup request primes before the instance takes traffic.
+
+"""
+
+import time
+from datetime import date
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from coalesce import expire
+from coalesce import expireMulti
+from coalesce import getOrCompute
+from coalesce import store
+from models import Conference
+from models import Session
+from reads import get
+
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
+                    'are nearly sold out: %s')
+MEMCACHE_SPEAKER_KEY = "FEATURED SPEAKER"
+SPEAKER_TPL = ('%s is also speaking at the following sessions: %s')
+MEMCACHE_SPEAKER_SOURCE_KEY = "FEATURED SPEAKER SOURCE"
+MEMCACHE_CONFERENCE_KEY = "CONFERENCE:%s"
+MEMCACHE_AGENDA_KEY = "AGENDA:%s"
+
+ANNOUNCEMENT_SOFT_TTL = 600
+SPEAKER_SOFT_TTL = 600
+CONFERENCE_SOFT_TTL = 60
+CONFERENCE_HARD_TTL = 3600
+AGENDA_SOFT_TTL = 600
+AGENDA_HARD_TTL = 3600
+
+LOCAL_TTL = 60              # seconds an in-instance copy stays fresh
+UPCOMING_KEY = 'UPCOMING_CONFERENCES'
+UPCOMING_LIMIT = 10
+
+_local = {}
+
+
+def localGet(key):
+    """Return the in-instance copy of key, or None once it expired."""
+    entry = _local.get(key)
+    if entry and entry[1] > time.time():
+        return entry[0]
+    return None
+
+
+def localSet(key, value, ttl=LOCAL_TTL):
+    """Keep value in this instance for ttl seconds."""
+    _local[key] = (value, time.time() + ttl)
+
+
+def computeAnnouncement():
+    """Return the announcement of nearly sold out conferences, or ""."""
+    # archival imports this module
+    from archival import archivedBackfilled
+    from archival import dropArchived
+    from archival import onlyUnarchived
+    q = onlyUnarchived(Conference.query(ndb.AND(
+        Conference.seatsAvailable <= 5,
+        Conference.seatsAvailable > 0)), Conference)
+    if archivedBackfilled():
+        confs = q.fetch(projection=[Conference.name])
+    else:
+        confs = dropArchived(q.fetch())
+
+    if confs:
+        # If there are almost sold out conferences, format announcement
+        return ANNOUNCEMENT_TPL % (', '.join(conf.name for conf in confs))
+    return ""
+
+
+def localDelete(key):
+    """Drop the in-instance copy of key."""
+    _local.pop(key, None)
+
+
+def cacheAnnouncement():
+    """Create Announcement & assign to memcache; used by
+    memcache cron job.
+    """
+    announcement = computeAnnouncement()
+    store(MEMCACHE_ANNOUNCEMENTS_KEY, announcement, ANNOUNCEMENT_SOFT_TTL)
+    localSet(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+    return announcement
+
+
+def getAnnouncement():
+    """Return Announcement from the instance or memcache, computing it
+    if neither has it."""
+    announcement = localGet(MEMCACHE_ANNOUNCEMENTS_KEY)
+    if announcement is None:
+        announcement = getOrCompute(MEMCACHE_ANNOUNCEMENTS_KEY,
+                                    computeAnnouncement,
+                                    ANNOUNCEMENT_SOFT_TTL)
+        localSet(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+    return announcement
+
+
+def computeFeaturedSpeaker():
+    """Return the featured speaker text for the latest speaker checked
+    by the check_speaker task, or ""."""
+    source = memcache.get(MEMCACHE_SPEAKER_SOURCE_KEY)
+    if not source:
+        return ""
+    speaker, wsck = source
+    sessions = Session.query(ancestor=ndb.Key(urlsafe=wsck))
+    sessions = sessions.filter(Session.speaker == speaker).fetch()
+
+    if len(sessions) > 1:
+        # If there are repeated speakers, format speaker
+        return SPEAKER_TPL % (speaker,
+            ', '.join(sess.sessionName for sess in sessions))
+    return ""
+
+
+def cacheFeaturedSpeaker(speaker, wsck):
+    """Record the speaker of a new session as featured speaker candidate;
+    used by the check_speaker task. The text itself is recomputed on the
+    next read.
+    """
+    memcache.set(MEMCACHE_SPEAKER_SOURCE_KEY, (speaker, wsck))
+    expire(MEMCACHE_SPEAKER_KEY)
+
+
+def getFeaturedSpeaker():
+    """Return featured speaker from memcache, computing it if missing."""
+    return getOrCompute(MEMCACHE_SPEAKER_KEY, computeFeaturedSpeaker,
+                        SPEAKER_SOFT_TTL)
+
+
+def conferenceCacheKey(wsck):
+    """Return the memcache key of a conference and its organizer name."""
+    return MEMCACHE_CONFERENCE_KEY % wsck
+
+
+def getConferenceWithOrganizer(wsck):
+    """Return (Conference, organizer displayName), or None if there is
+    no such conference."""
+    def compute():
+        conf = get(ndb.Key(urlsafe=wsck), 'getConference')
+        if not conf:
+            return None
+        prof = get(conf.key.parent(), 'organizerNames')
+        return (conf, getattr(prof, 'displayName', None))
+    return getOrCompute(conferenceCacheKey(wsck), compute,
+                        CONFERENCE_SOFT_TTL, CONFERENCE_HARD_TTL)
+
+
+def expireConference(wsck):
+    """Mark a cached conference stale once a write to it commits."""
+    ndb.get_context().call_on_commit(
+        lambda: expire(conferenceCacheKey(wsck)))
+
+
+def getRenderedAgenda(user_id, render):
+    """Return the rendered personal agenda of user_id, rendering it
+    with render() if it is not cached."""
+    return getOrCompute(MEMCACHE_AGENDA_KEY % user_id, render,
+                        AGENDA_SOFT_TTL, AGENDA_HARD_TTL)
+
+
+def expireAgenda(user_id):
+    """Mark a rendered agenda stale once a wishlist change commits."""
+    ndb.get_context().call_on_commit(
+        lambda: expire(MEMCACHE_AGENDA_KEY % user_id))
+
+
+def expireAgendas(user_ids):
+    """Mark the rendered agendas of user_ids stale, e.g. after a session
+    was deleted from their wishlists."""
+    expireMulti([MEMCACHE_AGENDA_KEY % user_id for user_id in user_ids])
+
+
+def conferenceChanged(wsck, changed):
+    """Expire the caches derived from the changed Conference properties;
+    'deleted' stands for a conference that was deleted."""
+    if changed & set(['name', 'seatsAvailable', 'archived', 'deleted']):
+        expire(MEMCACHE_ANNOUNCEMENTS_KEY)
+        localDelete(MEMCACHE_ANNOUNCEMENTS_KEY)
+    if changed & set(['name', 'startDate', 'archived', 'deleted']):
+        localDelete(UPCOMING_KEY)
+    if changed & set(['archived', 'deleted']):
+        expire(conferenceCacheKey(wsck))
+
+
+def getUpcomingConferences():
+    """Return the next conferences to start, earliest first."""
+    confs = localGet(UPCOMING_KEY)
+    if confs is None:
+        q = Conference.query(Conference.startDate >= date.today())
+        confs = q.order(Conference.startDate).fetch(UPCOMING_LIMIT)
+        localSet(UPCOMING_KEY, confs)
+    return confs
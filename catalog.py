@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+"""catalog.py
+
+Prebuilt public conference catalog.
+
+A cron materializes every unarchived conference, with its organizer
+name, seats and session count, into one compact JSON document:
+
+    {"generation": 7, "fields": ["websafeKey", "name", ...],
+     "rows": [["ag9...", "PyCon", ...], ...]}
+
+It is stored zlib-compressed in chunks small enough for memcache, with
+the datastore as fallback, and versioned by generation. Anonymous browse
+traffic is served from it (and filtered by the client) without any
+datastore query. A generation's snapshot and chunks are written in one
+transaction, so a snapshot is never seen without its chunks.
+
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import zlib
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from archival import dropArchived
+from archival import onlyUnarchived
+from caches import localGet
+from caches import localSet
+from coalesce import singleFlight
+from models import CatalogChunk
+from models import CatalogSnapshot
+from models import Conference
+from models import Profile
+from models import Session
+
+MEMCACHE_CATALOG_KEY = 'CATALOG'
+MEMCACHE_CHUNK_KEY = 'CATALOG:%d:%d'
+CHUNK_SIZE = 900 * 1024         # below the memcache and entity limits
+KEEP_GENERATIONS = 2
+BUILD_LEASE_SECONDS = 60        # the request deadline
+
+FIELDS = ['websafeKey', 'name', 'city', 'topics', 'startDate', 'endDate',
+          'month', 'maxAttendees', 'seatsAvailable', 'organizerDisplayName',
+          'sessionCount']
+
+
+def _row(conf, names, session_counts):
+    return [conf.key.urlsafe(), conf.name, conf.city, conf.topics,
+            str(conf.startDate) if conf.startDate else None,
+            str(conf.endDate) if conf.endDate else None,
+            conf.month, conf.maxAttendees, conf.seatsAvailable,
+            names.get(conf.organizerUserId),
+            session_counts.get(conf.key.id(), 0)]
+
+
+def buildCatalog():
+    """Materialize and store a new catalog generation; returns its
+    (etag, compressed chunks)."""
+    confs = dropArchived(onlyUnarchived(Conference.query(),
+                                        Conference).fetch())
+
+    organisers = set(ndb.Key(Profile, conf.organizerUserId)
+                     for conf in confs)
+    names = dict((prof.key.id(), prof.displayName)
+                 for prof in ndb.get_multi(list(organisers)) if prof)
+
+    # one keys-only pass over sessions instead of a count per conference;
+    # sessions hang off the conference id (see _createSessionObject)
+    session_counts = collections.Counter(
+        key.parent().id() for key in
+        onlyUnarchived(Session.query(), Session).iter(keys_only=True))
+
+    latest = CatalogSnapshot.query().order(
+        -CatalogSnapshot.generation).get()
+    generation = (latest.generation if latest else 0) + 1
+    confs.sort(key=lambda conf: conf.name)
+    text = json.dumps({'generation': generation, 'fields': FIELDS,
+                       'rows': [_row(conf, names, session_counts)
+                                for conf in confs]},
+                      separators=(',', ':'))
+    etag = '"%d-%s"' % (generation, hashlib.md5(text).hexdigest()[:12])
+
+    blob = zlib.compress(text)
+    chunks = [blob[i:i + CHUNK_SIZE] for i in range(0, len(blob), CHUNK_SIZE)]
+    snapshot = CatalogSnapshot(id=generation, generation=generation,
+                               etag=etag, chunks=len(chunks))
+
+    @ndb.transactional()
+    def _txn():
+        existing = snapshot.key.get()
+        if existing:
+            return existing
+        ndb.put_multi([snapshot] + [
+            CatalogChunk(parent=snapshot.key, id=i + 1, data=chunk)
+            for i, chunk in enumerate(chunks)])
+        return None
+    existing = _txn()
+    if existing:
+        logging.info('Catalog generation %d was built concurrently',
+                     generation)
+        return _load(existing)
+    _cacheChunks(snapshot, chunks)
+
+    # drop generations nobody is served any more
+    old = CatalogSnapshot.query(
+        CatalogSnapshot.generation <= generation - KEEP_GENERATIONS
+    ).fetch(keys_only=True)
+    for key in old:
+        ndb.delete_multi(CatalogChunk.query(ancestor=key).fetch(
+            keys_only=True) + [key])
+    return etag, chunks
+
+
+def _cacheChunks(snapshot, chunks):
+    mapping = dict((MEMCACHE_CHUNK_KEY % (snapshot.generation, i + 1), chunk)
+                   for i, chunk in enumerate(chunks))
+    memcache.set_multi(mapping)
+    # publish the pointer last, once every chunk is in place
+    memcache.set(MEMCACHE_CATALOG_KEY, {'generation': snapshot.generation,
+                                        'etag': snapshot.etag,
+                                        'chunks': snapshot.chunks})
+
+
+def _load(snapshot):
+    """Return (etag, chunks) of snapshot, or None if any is missing."""
+    found = ndb.get_multi([ndb.Key(CatalogChunk, i + 1, parent=snapshot.key)
+                           for i in range(snapshot.chunks)])
+    if None in found:
+        # e.g. a generation deleted since the snapshot was read
+        logging.warning('Catalog generation %d is missing chunks',
+                        snapshot.generation)
+        return None
+    chunks = [chunk.data for chunk in found]
+    _cacheChunks(snapshot, chunks)
+    return snapshot.etag, chunks
+
+
+def _loadFromDatastore():
+    snapshot = CatalogSnapshot.query().order(
+        -CatalogSnapshot.generation).get()
+    if not snapshot:
+        return None
+    return _load(snapshot)
+
+
+def getCatalog():
+    """Return (etag, JSON text) of the current catalog, or None if there
+    is none yet. The first generation is then built by one request;
+    the others are meant to fall back to the live query meanwhile."""
+    pointer = memcache.get(MEMCACHE_CATALOG_KEY)
+    if pointer:
+        cached = localGet(MEMCACHE_CATALOG_KEY)
+        if cached and cached[0] == pointer['etag']:
+            return cached
+        keys = [MEMCACHE_CHUNK_KEY % (pointer['generation'], i + 1)
+                for i in range(pointer['chunks'])]
+        found = memcache.get_multi(keys)
+        if len(found) == len(keys):
+            loaded = pointer['etag'], [found[key] for key in keys]
+        else:
+            loaded = _loadFromDatastore()
+    else:
+        loaded = _loadFromDatastore()
+    if not loaded:
+        loaded = singleFlight(MEMCACHE_CATALOG_KEY, buildCatalog,
+                              BUILD_LEASE_SECONDS)
+        if not loaded:
+            return None
+
+    etag, chunks = loaded
+    catalog = (etag, zlib.decompress(''.join(chunks)))
+    localSet(MEMCACHE_CATALOG_KEY, catalog)
+    return catalog
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""coalesce.py
+
+Single-flight recomputation of memcache values.
+
+Values are stored with a soft expiry next to the memcache (hard) one.
+When a value is missing or past its soft expiry, the first request to
+take the memcache add()-based lease recomputes it; concurrent requests
+get the stale value, or briefly wait for the lease holder when there is
+none. The result is written back with cas() (or add() for a missing
+key), so a value that was expired by a write while it was being
+computed never overwrites the newer state. Expiring a key that holds no
+value writes a short-lived tombstone in its place, which makes the add()
+of a lease holder that read the key before the write fail as well.
+
+"""
+
+import logging
+import time
+
+from google.appengine.api import memcache
+
+LEASE_SECONDS = 10
+WAIT_STEP = 0.05            # seconds between polls for a lease holder
+WAIT_STEPS = 20
+CAS_RETRIES = 3
+TOMBSTONE_SECONDS = 60      # the request deadline; no computation outlives it
+
+
+def _leaseKey(key):
+    return 'LEASE:' + key
+
+
+def _entry(value, soft_ttl, hard_ttl):
+    now = time.time()
+    return {'value': value,
+            'soft': now + soft_ttl,
+            'hard': int(now + hard_ttl) if hard_ttl else 0}
+
+
+def _isValue(raw):
+    """Return whether raw is a cached entry rather than a tombstone."""
+    return isinstance(raw, dict) and not raw.get('tombstone')
+
+
+def getOrCompute(key, compute, soft_ttl, hard_ttl=0):
+    """Return the value cached under key, recomputing it single-flight.
+
+    compute() is called by at most one request per key at a time; the
+    value counts as fresh for soft_ttl seconds and is kept (stale) in
+    memcache for hard_ttl seconds, or until evicted when hard_ttl is 0.
+    """
+    client = memcache.Client()
+    raw = client.gets(key)
+    entry = raw if _isValue(raw) else None
+    if entry is not None and entry['soft'] > time.time():
+        return entry['value']
+
+    if client.add(_leaseKey(key), 1, time=LEASE_SECONDS):
+        try:
+            value = compute()
+            new = _entry(value, soft_ttl, hard_ttl)
+            if raw is None:
+                stored = client.add(key, new, time=new['hard'])
+            else:
+                stored = client.cas(key, new, time=new['hard'])
+            if not stored:
+                logging.debug('%s changed while recomputing; not stored', key)
+            return value
+        finally:
+            client.delete(_leaseKey(key))
+
+    # someone else holds the lease: serve stale, or wait for their value
+    if entry is not None:
+        return entry['value']
+    for _ in range(WAIT_STEPS):
+        time.sleep(WAIT_STEP)
+        raw = client.get(key)
+        if _isValue(raw):
+            return raw['value']
+    # the lease holder is slow or died; answer without caching
+    return compute()
+
+
+def singleFlight(key, compute, lease_seconds=LEASE_SECONDS):
+    """Return compute(), unless another request is computing key; then
+    return None without calling it."""
+    client = memcache.Client()
+    if not client.add(_leaseKey(key), 1, time=lease_seconds):
+        return None
+    try:
+        return compute()
+    finally:
+        client.delete(_leaseKey(key))
+
+
+def store(key, value, soft_ttl, hard_ttl=0):
+    """Unconditionally cache a freshly computed value under key."""
+    new = _entry(value, soft_ttl, hard_ttl)
+    memcache.set(key, new, time=new['hard'])
+
+
+def expire(key):
+    """Mark the value under key stale, keeping it to serve during the
+    recomputation."""
+    expireMulti([key])
+
+
+def expireMulti(keys):
+    """Mark the values under keys stale, keeping them to serve during the
+    recomputation; keys holding no value get a tombstone."""
+    client = memcache.Client()
+    pending = list(keys)
+    for _ in range(CAS_RETRIES):
+        if not pending:
+            return
+        found = client.get_multi(pending, for_cas=True)
+        # cas_multi takes one expiry, so group the entries by theirs
+        by_hard = {}
+        for key in pending:
+            raw = found.get(key)
+            if _isValue(raw):
+                raw['soft'] = 0
+                by_hard.setdefault(raw['hard'], {})[key] = raw
+        missing = [key for key in pending if not _isValue(found.get(key))]
+        if missing:
+            client.set_multi(dict((key, {'tombstone': True})
+                                  for key in missing),
+                             time=TOMBSTONE_SECONDS)
+        pending = []
+        for hard, entries in by_hard.items():
+            pending.extend(client.cas_multi(entries, time=hard))
+    if pending:
+        client.set_multi(dict((key, {'tombstone': True}) for key in pending),
+                         time=TOMBSTONE_SECONDS)
@@ -18,11 +18,12 @@ import endpoints
 import logging
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
+from google.appengine.api import datastore_errors
 from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
 
 from models import ConflictException
 from models import Profile
@@ -41,21 +42,73 @@ from models import SessionForm
 from models import SessionForms
 from models import SessionQueryForm
 from models import SessionQueryForms
+from models import AgendaDayForm
+from models import AgendaForm
+from models import AgendaItemForm
+from models import MyAgendaForm
+from models import WishlistEntry
+from models import CatalogForm
+from models import RecommendationForm
+from models import RecommendationForms
+from models import NotificationForm
+from models import NotificationForms
+from models import AttendeeExport
+from models import ExportForm
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
 
+from utils import findConflicts
 from utils import getUserId
 
+from caches import conferenceChanged
+from caches import expireConference
+from caches import getAnnouncement
+from caches import getConferenceWithOrganizer
+from caches import getRenderedAgenda
+from caches import expireAgenda
+from caches import getFeaturedSpeaker
+from caches import getUpcomingConferences
+
+from archival import archivedBackfilled
+from archival import dropArchived
+from archival import onlyUnarchived
+
+from catalog import getCatalog
+
+from digests import CONFIRMATION_QUEUE
+from digests import confirmationPayload
+
+from recommendations import getRecommendations
+from recommendations import refreshLater
+
+from purge import deleteWithTombstone
+
+from reads import getMulti
+
+from exports import downloadUrl
+from exports import expired
+from exports import rowsPerSecond
+from exports import startExport
+
+from notifications import inboxQuery
+from notifications import markRead
+from notifications import noticeOf
+from notifications import notifyAttendees
+from notifications import unreadCount
+
+from outbox import addOutboxTask
+from outbox import withOutbox
+
+from ratelimit import rateLimited
+
+from indexes import formatShape
+from indexes import queryShape
+
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
-                    'are nearly sold out: %s')
-MEMCACHE_SPEAKER_KEY = "FEATURED SPEAKER"
-SPEAKER_TPL = ('%s is also speaking at the following sessions: %s')
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -74,6 +127,14 @@ OPERATORS = {
             'NE':   '!='
             }
 
+# ConferenceForm fields an organizer may change; seatsAvailable and
+# month are derived from maxAttendees and startDate
+UPDATABLE_FIELDS = ('name', 'description', 'topics', 'city',
+                    'startDate', 'endDate', 'maxAttendees')
+
+AGENDA_PAGE_SIZE = 50
+AGENDA_MAX_PAGE_SIZE = 200
+
 FIELDS =    {
             'CITY': 'city',
             'TOPIC': 'topics',
@@ -81,6 +142,34 @@ FIELDS =    {
             'MAX_ATTENDEES': 'maxAttendees',
             }
 
+# form field -> model property copy layouts, see formMapper()
+FORM_MODELS = {
+    ConferenceForm: (Conference, lambda name: name.endswith('Date')),
+    SessionForm: (Session,
+                  lambda name: (name.endswith('date') or
+                                name.endswith('Time') or name == 'duration')),
+}
+_FORM_MAPPERS = {}
+
+
+def formMapper(form_cls):
+    """Return the (field name, copy as string) pairs copied from the
+    model of form_cls, computed once per instance."""
+    mapper = _FORM_MAPPERS.get(form_cls)
+    if mapper is None:
+        model_cls, as_string = FORM_MODELS[form_cls]
+        mapper = [(field.name, as_string(field.name))
+                  for field in form_cls.all_fields()
+                  if field.name in model_cls._properties]
+        _FORM_MAPPERS[form_cls] = mapper
+    return mapper
+
+
+def primeFormMappers():
+    """Compute every form mapper; called by the warmup request."""
+    for form_cls in FORM_MODELS:
+        formMapper(form_cls)
+
 # Request data containers for endpoint methods
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
@@ -92,6 +181,12 @@ CONF_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_PATCH_REQUEST = endpoints.ResourceContainer(
+    ConferenceForm,
+    websafeConferenceKey=messages.StringField(1),
+    fieldMask=messages.StringField(2, repeated=True),
+)
+
 SESS_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSessionKey=messages.StringField(1),
@@ -100,6 +195,12 @@ SESS_GET_REQUEST = endpoints.ResourceContainer(
 SESS_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     speaker=messages.StringField(1),
+    includeArchived=messages.BooleanField(2),
+)
+
+ARCHIVED_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    includeArchived=messages.BooleanField(1),
 )
 
 SESS_TYPE_GET_REQUEST = endpoints.ResourceContainer(
@@ -108,6 +209,31 @@ SESS_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     typeOfSession=messages.StringField(2),
 )
 
+CONF_AGENDA_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    start=messages.StringField(2),
+    end=messages.StringField(3),
+    pageSize=messages.IntegerField(4, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(5),
+)
+
+AGENDA_PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(2),
+)
+
+CATALOG_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ifNoneMatch=messages.StringField(1),
+)
+
+EXPORT_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeExportKey=messages.StringField(1),
+)
+
 PROFILE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     mainEmail=messages.StringField(1)
@@ -127,21 +253,27 @@ class ConferenceApi(remote.Service):
     def _copyConferenceToForm(self, conf, displayName):
         """Copy relevant fields from Conference to ConferenceForm."""
         cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+        for name, as_string in formMapper(ConferenceForm):
+            # convert Date to date string; just copy others
+            if as_string:
+                setattr(cf, name, str(getattr(conf, name)))
+            else:
+                setattr(cf, name, getattr(conf, name))
+        cf.websafeKey = conf.key.urlsafe()
         if displayName:
             setattr(cf, 'organizerDisplayName', displayName)
         cf.check_initialized()
         return cf
 
 
+    def _parseDate(self, value, name):
+        """Parse a 'YYYY-MM-DD' conference date field."""
+        try:
+            return datetime.strptime(value[:10], "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "'%s' must look like YYYY-MM-DD" % name)
+
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
         # preload necessary data items
@@ -157,6 +289,7 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['version']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -166,12 +299,12 @@ class ConferenceApi(remote.Service):
 
         # convert dates from strings to Date objects; set month based on start_date
         if data['startDate']:
-            data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
+            data['startDate'] = self._parseDate(data['startDate'], 'startDate')
             data['month'] = data['startDate'].month
         else:
             data['month'] = 0
         if data['endDate']:
-            data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+            data['endDate'] = self._parseDate(data['endDate'], 'endDate')
 
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
@@ -184,58 +317,106 @@ class ConferenceApi(remote.Service):
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        # create Conference and, in the same transaction, the task
+        # mailing the organizer a confirmation; return (modified) ConferenceForm
+        @ndb.transactional()
+        def _txn():
+            Conference(version=1, **data).put()
+            addOutboxTask(c_key, 'confirm', queue_name=CONFIRMATION_QUEUE,
+                          payload=confirmationPayload(user.email(),
+                                                      c_key.urlsafe()),
+                          method='PULL', tag=user.email())
+        _txn()
         return request
 
 
-    @ndb.transactional()
-    def _updateConferenceObject(self, request):
+    def _updateConferenceObject(self, request, field_mask):
+        """Apply the masked fields of request to a Conference.
+
+        request.version, when given, must match the stored version;
+        otherwise the conference changed since the client read it.
+        """
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
 
-        # copy ConferenceForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+        invalid = set(field_mask) - set(UPDATABLE_FIELDS)
+        if invalid:
+            raise endpoints.BadRequestException(
+                'Fields cannot be updated: %s' % ', '.join(sorted(invalid)))
+        if 'name' in field_mask and not request.name:
+            raise endpoints.BadRequestException(
+                "Conference 'name' field required")
+
+        # convert dates from strings to Date objects outside the transaction
+        values = {}
+        for name in field_mask:
+            value = getattr(request, name)
+            if name in ('startDate', 'endDate') and value:
+                value = self._parseDate(value, name)
+            values[name] = value
 
-        # update existing conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        wsck = request.websafeConferenceKey
+        conf, changed = self._applyConferenceUpdate(
+            ndb.Key(urlsafe=wsck), user_id, request.version, values)
+        if changed:
+            conferenceChanged(wsck, changed)
+        prof = ndb.Key(Profile, user_id).get()
+        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+
+
+    @ndb.transactional()
+    def _applyConferenceUpdate(self, c_key, user_id, version, values):
+        """Transaction on the Conference entity group; returns the
+        Conference and the set of properties that actually changed."""
+        conf = c_key.get()
         # check that conference exists
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
+                'No conference found with key: %s' % c_key.urlsafe())
 
         # check that user is owner
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
-        # Not getting all the fields, so don't create a new object; just
-        # copy relevant fields from ConferenceForm to Conference object
-        for field in request.all_fields():
-            data = getattr(request, field.name)
-            # only copy fields where we get data
-            if data not in (None, []):
-                # special handling for dates (convert string to Date)
-                if field.name in ('startDate', 'endDate'):
-                    data = datetime.strptime(data, "%Y-%m-%d").date()
-                    if field.name == 'startDate':
-                        conf.month = data.month
-                # write to Conference object
-                setattr(conf, field.name, data)
-        conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        if version is not None and version != conf.version:
+            raise ConflictException(
+                'Conference was modified since version %d; it is now at '
+                'version %d.' % (version, conf.version))
+
+        # attendees registered so far, to carry over to a new maxAttendees
+        registered = (conf.maxAttendees or 0) - (conf.seatsAvailable or 0)
+        changed = set()
+        for name, value in values.items():
+            if getattr(conf, name) != value:
+                setattr(conf, name, value)
+                changed.add(name)
+
+        # keep derived properties in step with the fields they come from
+        if 'startDate' in changed:
+            conf.month = conf.startDate.month if conf.startDate else 0
+            changed.add('month')
+        if 'maxAttendees' in changed:
+            if (conf.maxAttendees or 0) < registered:
+                raise ConflictException(
+                    'Cannot lower maxAttendees below the %d attendees '
+                    'already registered.' % registered)
+            conf.seatsAvailable = (conf.maxAttendees or 0) - registered
+            changed.add('seatsAvailable')
+
+        if changed:
+            conf.version += 1
+            conf.put()
+            expireConference(c_key.urlsafe())
+            notifyAttendees(conf, changed)
+        return conf, changed
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
+    @withOutbox
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -244,9 +425,51 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
+    @withOutbox
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        # only copy fields where we get data
+        field_mask = [name for name in UPDATABLE_FIELDS
+                      if getattr(request, name) not in (None, [])]
+        return self._updateConferenceObject(request, field_mask)
+
+
+    @endpoints.method(CONF_PATCH_REQUEST, ConferenceForm,
+            path='conference/{websafeConferenceKey}',
+            http_method='PATCH', name='patchConference')
+    @withOutbox
+    def patchConference(self, request):
+        """Update the fields named in fieldMask (which may clear them),
+        checking version if given, & return w/updated info."""
+        if not request.fieldMask:
+            raise endpoints.BadRequestException('fieldMask is required')
+        return self._updateConferenceObject(request, request.fieldMask)
+
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/delete',
+            http_method='DELETE', name='deleteConference')
+    @withOutbox
+    def deleteConference(self, request):
+        """Delete a conference (organizer only); its sessions and the
+        registrations for it are removed in the background."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        wsck = request.websafeConferenceKey
+        conf = ndb.Key(urlsafe=wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        if getUserId(user) != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can delete the conference.')
+
+        deleted = deleteWithTombstone(conf.key, noticeOf(
+            conf, 'conferenceDeleted', '%s was cancelled' % conf.name))
+        if deleted:
+            conferenceChanged(wsck, set(['deleted']))
+        return BooleanMessage(data=deleted)
 
 
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
@@ -256,13 +479,13 @@ class ConferenceApi(remote.Service):
         """Return requested conference (by websafeConferenceKey)."""
         # get Conference object from request; bail if not found
         logging.info('Signed by user %s', request.websafeConferenceKey)
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
+        cached = getConferenceWithOrganizer(request.websafeConferenceKey)
+        if not cached:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+        conf, displayName = cached
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return self._copyConferenceToForm(conf, displayName)
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -287,8 +510,13 @@ class ConferenceApi(remote.Service):
 
     def _getQuery(self, request):
         """Return formatted query from the submitted filters."""
-        q = Conference.query()
         inequality_filter, filters = self._formatFilters(request.filters)
+        return self._buildQuery(inequality_filter, filters)
+
+
+    def _buildQuery(self, inequality_filter, filters):
+        """Return the ordered query for already formatted filters."""
+        q = Conference.query()
 
         # If exists, sort on inequality filter first
         if not inequality_filter:
@@ -298,8 +526,6 @@ class ConferenceApi(remote.Service):
             q = q.order(Conference.name)
 
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
             formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
         return q
@@ -319,6 +545,13 @@ class ConferenceApi(remote.Service):
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter on '%s' requires an integer value." % filtr["field"])
+
             # Every operation except "=" is an inequality
             if filtr["operator"] != "=":
                 # check if inequality operation has been used in previous filters
@@ -333,27 +566,83 @@ class ConferenceApi(remote.Service):
         return (inequality_field, formatted_filters)
 
 
-    @endpoints.method(ConferenceQueryForms, ConferenceForms,
-            path='queryConferences',
-            http_method='POST',
-            name='queryConferences')
-    def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+    def _fetchConferences(self, request):
+        """Run the conference query, falling back to in-memory merging.
+
+        The datastore serves the query from a composite index, or by
+        zig-zag merging the per-property indexes in index.yaml. Shapes
+        with neither raise NeedIndexError and are answered by
+        intersecting keys-only single-property queries instead.
+        """
+        inequality_filter, filters = self._formatFilters(request.filters)
+        if not request.includeArchived and archivedBackfilled():
+            # matches nearly every conference, so the in-memory merge
+            # applies it to the fetched entities instead of querying it
+            filters.append({"field": "archived", "operator": "=",
+                            "value": False, "inMemory": True})
+        logging.info(formatShape(queryShape(inequality_filter, filters)))
+        try:
+            confs = self._buildQuery(inequality_filter, filters).fetch()
+        except datastore_errors.NeedIndexError:
+            logging.warning('No index for conference query, merging in memory')
+            confs = self._mergeConferences(inequality_filter, filters)
+        return confs if request.includeArchived else dropArchived(confs)
+
+
+    def _mergeConferences(self, inequality_filter, filters):
+        """Intersect keys-only single-filter queries and order in memory."""
+        # each single-property filter is served by a built-in index
+        selective = [f for f in filters if not f.get("inMemory")]
+        futures = [Conference.query(ndb.query.FilterNode(
+                       filtr["field"], filtr["operator"], filtr["value"])
+                   ).fetch_async(keys_only=True) for filtr in selective]
+        keys = None
+        for future in futures:
+            found = set(future.get_result())
+            keys = found if keys is None else keys & found
+        if keys is None:
+            return self._buildQuery(inequality_filter, filters).fetch()
+
+        confs = [conf for conf in ndb.get_multi(list(keys)) if conf and
+                 all(getattr(conf, f["field"]) == f["value"]
+                     for f in filters if f.get("inMemory"))]
+        if inequality_filter:
+            confs.sort(key=lambda conf: (getattr(conf, inequality_filter),
+                                         conf.name))
+        else:
+            confs.sort(key=lambda conf: conf.name)
+        return confs
+
 
+    def _organizerNames(self, conferences):
+        """Return {organizerUserId: displayName} for conferences."""
         # need to fetch organiser displayName from profiles
         # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        organisers = set(ndb.Key(Profile, conf.organizerUserId)
+                         for conf in conferences)
+        profiles = getMulti(list(organisers), 'organizerNames')
 
         # put display names in a dict for easier fetching
         names = {}
         for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+            if profile:
+                names[profile.key.id()] = profile.displayName
+        return names
+
+
+    @endpoints.method(ConferenceQueryForms, ConferenceForms,
+            path='queryConferences',
+            http_method='POST',
+            name='queryConferences')
+    @rateLimited
+    def queryConferences(self, request):
+        """Query for conferences."""
+        conferences = self._fetchConferences(request)
+        names = self._organizerNames(conferences)
 
         # return individual ConferenceForm object per Conference
         return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
+                items=[self._copyConferenceToForm(conf, names.get(conf.organizerUserId)) for conf in \
                 conferences]
         )
 
@@ -371,6 +660,9 @@ class ConferenceApi(remote.Service):
                     setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
                 else:
                     setattr(pf, field.name, getattr(prof, field.name))
+        # the wishlist lives in WishlistEntry children keyed by session
+        pf.sessionKeysToAttend = [key.id() for key in
+                                  self._wishlistQuery(prof).fetch(keys_only=True)]
         pf.check_initialized()
         return pf
 
@@ -424,44 +716,128 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(ProfileMiniForm, ProfileForm, path='profile',
                       http_method='POST', name='saveProfile')
+    @rateLimited
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
 
 
-# - - - Announcements - - - - - - - - - - - - - - - - - - - -
+# - - - Catalog - - - - - - - - - - - - - - - - - - - - - - - -
 
-    @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+    @endpoints.method(CATALOG_GET_REQUEST, CatalogForm,
+                      path='catalog', http_method='GET',
+                      name='getCatalogSnapshot')
+    def getCatalogSnapshot(self, request):
+        """Return the prebuilt public catalog, or just notModified if the
+        client already has the generation named by ifNoneMatch."""
+        catalog = getCatalog()
+        if not catalog:
+            raise endpoints.NotFoundException(
+                'The catalog is being built; use queryConferences')
+        etag, data = catalog
+        if request.ifNoneMatch == etag:
+            return CatalogForm(etag=etag, notModified=True)
+        return CatalogForm(etag=etag, notModified=False, data=data)
+
+# - - - Notifications - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(AGENDA_PAGE_REQUEST, NotificationForms,
+                      path='notifications', http_method='GET',
+                      name='getNotifications')
+    def getNotifications(self, request):
+        """Return a page of the logged user's notifications, newest first,
+        with the number not marked read."""
+        prof = self._getProfileFromUser()
+        page_size = min(request.pageSize or AGENDA_PAGE_SIZE,
+                        AGENDA_MAX_PAGE_SIZE)
+        cursor = None
+        if request.pageToken:
+            try:
+                cursor = Cursor(urlsafe=request.pageToken)
+            except datastore_errors.BadValueError:
+                raise endpoints.BadRequestException('Invalid pageToken')
+        notes, next_cursor, more = inboxQuery(prof).fetch_page(
+            page_size, start_cursor=cursor)
+
+        read = prof.notificationsRead
+        return NotificationForms(
+            items=[NotificationForm(kind=note.kind,
+                                    websafeKey=note.websafeKey,
+                                    message=note.message,
+                                    created=str(note.created),
+                                    unread=not read or note.created > read)
+                   for note in notes],
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor
+            else None,
+            unread=unreadCount(prof))
+
+    @endpoints.method(message_types.VoidMessage, BooleanMessage,
+                      path='notifications/read', http_method='POST',
+                      name='markNotificationsRead')
+    def markNotificationsRead(self, request):
+        """Mark all of the logged user's notifications as read."""
+        markRead(self._getProfileFromUser(), datetime.now())
+        return BooleanMessage(data=True)
+
+# - - - Attendee exports - - - - - - - - - - - - - - - - - -
+
+    def _copyExportToForm(self, export):
+        """Copy relevant fields from AttendeeExport to ExportForm."""
+        return ExportForm(websafeKey=export.key.urlsafe(), done=export.done,
+                          rows=export.rows,
+                          rowsPerSecond=rowsPerSecond(export),
+                          downloadUrl=downloadUrl(export)
+                          if export.done and not expired(export) else None)
+
+    @endpoints.method(CONF_GET_REQUEST, ExportForm,
+            path='conference/{websafeConferenceKey}/attendees/export',
+            http_method='POST', name='exportAttendees')
+    @withOutbox
+    def exportAttendees(self, request):
+        """Start building a CSV of the attendees of a conference (organizer
+        only); poll getAttendeeExport for its download URL."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        wsck = request.websafeConferenceKey
+        c_key = ndb.Key(urlsafe=wsck)
+        conf = c_key.get() if c_key.kind() == Conference.__name__ else None
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        user_id = getUserId(user)
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can export the attendees.')
+        return self._copyExportToForm(startExport(user_id, wsck))
+
+    @endpoints.method(EXPORT_GET_REQUEST, ExportForm,
+            path='exports/{websafeExportKey}',
+            http_method='GET', name='getAttendeeExport')
+    def getAttendeeExport(self, request):
+        """Return the progress of one of the logged user's exports."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        e_key = ndb.Key(urlsafe=request.websafeExportKey)
+        export = None
+        # exports are kept under their organizer's profile
+        if (e_key.kind() == AttendeeExport.__name__ and
+                e_key.parent() == ndb.Key(Profile, getUserId(user))):
+            export = e_key.get()
+        if not export:
+            raise endpoints.NotFoundException(
+                'No export found with key: %s' % request.websafeExportKey)
+        return self._copyExportToForm(export)
 
-        return announcement
+# - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='conference/announcement/get',
                       http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or
-                             "")
+        return StringMessage(data=getAnnouncement())
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
@@ -511,6 +887,9 @@ class ConferenceApi(remote.Service):
         # write things back to the datastore & return
         prof.put()
         conf.put()
+        expireConference(wsck)
+        if retval:
+            refreshLater(prof, conf)
         return BooleanMessage(data=retval)
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -522,27 +901,37 @@ class ConferenceApi(remote.Service):
         prof = self._getProfileFromUser()
         conf_keys = [ndb.Key(urlsafe=wsck)
                      for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
+        # deleted conferences stay listed until their purge reaches
+        # this profile; skip them
+        conferences = [conf for conf in
+                       getMulti(conf_keys, 'getConferencesToAttend') if conf]
 
         # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId)
-                      for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        names = self._organizerNames(conferences)
 
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf,
-                                              names[conf.organizerUserId])
+            items=[self._copyConferenceToForm(
+                       conf, names.get(conf.organizerUserId))
                    for conf in conferences])
 
+    @endpoints.method(message_types.VoidMessage, RecommendationForms,
+                      path='conferences/recommended',
+                      http_method='GET', name='getRecommendedConferences')
+    def getRecommendedConferences(self, request):
+        """Get conferences recommended from the user's registrations."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        return RecommendationForms(
+            items=[RecommendationForm(**item)
+                   for item in getRecommendations(getUserId(user))])
+
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='POST', name='registerForConference')
+    @rateLimited
+    @withOutbox
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
@@ -550,6 +939,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='DELETE', name='unregisterFromConference')
+    @withOutbox
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
@@ -579,15 +969,13 @@ class ConferenceApi(remote.Service):
         """Copy relevant fields from Session to SessionForm."""
         sf = SessionForm()
         # set fields of form with attributes
-        for field in sf.all_fields():
-            if hasattr(sess, field.name):
-                # convert Date to date string; just copy others
-                if (field.name.endswith('date')) or (field.name.endswith('Time')):
-                    setattr(sf, field.name, str(getattr(sess, field.name)))
-                else:
-                    setattr(sf, field.name, getattr(sess, field.name))
-            elif field.name == "websafeKey":
-                    setattr(sf, field.name, sess.key.urlsafe())
+        for name, as_string in formMapper(SessionForm):
+            # convert Date, Time & duration to strings; just copy others
+            value = getattr(sess, name)
+            if as_string and value is not None:
+                value = str(value)
+            setattr(sf, name, value)
+        sf.websafeKey = sess.key.urlsafe()
         sf.check_initialized()
         return sf
 
@@ -603,7 +991,7 @@ class ConferenceApi(remote.Service):
         conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
         # check validity
         if not conf:
-            raise endpoint.NotFoundException("Non-existing conference")
+            raise endpoints.NotFoundException("Non-existing conference")
 
         # Check if user is organizer
         if user_id != getattr(conf, 'organizerUserId'):
@@ -624,6 +1012,13 @@ class ConferenceApi(remote.Service):
         if data['startTime']:
             st = datetime.strptime(data['startTime'][:10], "%H:%M").time()
             data['startTime'] = st
+        # duration in minutes
+        if data['duration']:
+            try:
+                data['duration'] = int(data['duration'])
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    "Session 'duration' must be a number of minutes")
 
         conference_id = conf.key.id()
         c_key = ndb.Key(Conference, conference_id)
@@ -632,34 +1027,102 @@ class ConferenceApi(remote.Service):
         data['key'] = s_key
         del data['websafeConferenceKey']
         del data['websafeKey']
-
-        # create Session, enqueue check speaker task
-        Session(**data).put()
-        taskqueue.add(params={'speaker': data['speaker'],
-                              'wsck': c_key.urlsafe()},
-                      url='/tasks/check_speaker')
-        return self._copySessionToForm(s_key.get())
+        # derived on put
+        del data['startDateTime']
+        del data['endDateTime']
+
+        # create Session and its check speaker task in one transaction
+        sess = Session(**data)
+
+        @ndb.transactional()
+        def _txn():
+            sess.put()
+            addOutboxTask(s_key, 'check-speaker', url='/tasks/check_speaker',
+                          params={'speaker': data['speaker'],
+                                  'wsck': c_key.urlsafe()})
+        _txn()
+        return self._copySessionToForm(sess)
+
+    def _conferenceSessionQuery(self, wsck):
+        """Return the ancestor query for all sessions of a conference."""
+        # get Conference object from request; bail if not found
+        conf = ndb.Key(urlsafe=wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        # create ancestor query for all key matches for this conference
+        return Session.query(ancestor=ndb.Key(Conference, conf.key.id()))
 
     # Session endpoints
     @endpoints.method(CONF_GET_REQUEST, SessionForms,
                       path='conference/{websafeConferenceKey}/sessions',
                       http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
-        """Return all sessions of requested conference."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        conference_id = conf.key.id()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' %
-                request.websafeConferenceKey)
-        # create ancestor query for all key matches for this conference
-        sessions = Session.query(ancestor=ndb.Key(Conference, conference_id))
+        """Return all sessions of requested conference, by start time."""
+        sessions = self._conferenceSessions(request.websafeConferenceKey)
         # return set of SessionForm objects per Session
         return SessionForms(
             items=[self._copySessionToForm(sess) for sess in sessions]
         )
 
+    def _conferenceSessions(self, wsck):
+        """Return all sessions of a conference by start time, those
+        without one last."""
+        # sorted here, as ordering the query by startDateTime would drop
+        # sessions written before it was added
+        sessions = self._conferenceSessionQuery(wsck).fetch()
+        sessions.sort(key=lambda sess: (sess.startDateTime is None,
+                                        sess.startDateTime))
+        return sessions
+
+    def _parseDateTime(self, value, name):
+        """Parse a 'YYYY-MM-DD[THH:MM]' request parameter."""
+        for fmt in ("%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+            try:
+                return datetime.strptime(value[:16], fmt)
+            except ValueError:
+                pass
+        raise endpoints.BadRequestException(
+            "'%s' must look like YYYY-MM-DD or YYYY-MM-DDTHH:MM" % name)
+
+    @endpoints.method(CONF_AGENDA_GET_REQUEST, AgendaForm,
+                      path='conference/{websafeConferenceKey}/agenda',
+                      http_method='GET', name='getConferenceAgenda')
+    def getConferenceAgenda(self, request):
+        """Return a page of a conference's sessions between start and end,
+        ordered by start time and bucketed by day."""
+        q = self._conferenceSessionQuery(request.websafeConferenceKey)
+        if request.start:
+            start = self._parseDateTime(request.start, 'start')
+            q = q.filter(Session.startDateTime >= start)
+        if request.end:
+            end = self._parseDateTime(request.end, 'end')
+            q = q.filter(Session.startDateTime < end)
+        q = q.order(Session.startDateTime)
+
+        page_size = min(request.pageSize or AGENDA_PAGE_SIZE,
+                        AGENDA_MAX_PAGE_SIZE)
+        cursor = None
+        if request.pageToken:
+            try:
+                cursor = Cursor(urlsafe=request.pageToken)
+            except datastore_errors.BadValueError:
+                raise endpoints.BadRequestException('Invalid pageToken')
+        sessions, next_cursor, more = q.fetch_page(page_size,
+                                                   start_cursor=cursor)
+
+        # sessions arrive ordered by start, so each day is one run
+        days = []
+        for sess in sessions:
+            day = str(sess.startDateTime.date()) if sess.startDateTime else ''
+            if not days or days[-1].date != day:
+                days.append(AgendaDayForm(date=day))
+            days[-1].items.append(self._copySessionToForm(sess))
+        return AgendaForm(
+            days=days,
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor
+            else None)
+
     @endpoints.method(
         SESS_TYPE_GET_REQUEST, SessionForms,
         path='conference/{websafeConferenceKey}/sessions/{typeOfSession}',
@@ -691,6 +1154,8 @@ class ConferenceApi(remote.Service):
         """Return all sessions by speaker."""
         # filter by speaker property
         sessions = Session.query(Session.speaker == request.speaker)
+        if not request.includeArchived:
+            sessions = dropArchived(onlyUnarchived(sessions, Session).fetch())
 
         # return set of SessionForm objects per Session
         return SessionForms(
@@ -699,51 +1164,93 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(SessionForm, SessionForm, path='session',
                       http_method='POST', name='createSession')
+    @rateLimited
+    @withOutbox
     def createSession(self, request):
         """Create new session."""
         return self._createSessionObject(request)
 
+    @endpoints.method(SESS_GET_REQUEST, BooleanMessage,
+                      path='session/{websafeSessionKey}',
+                      http_method='DELETE', name='deleteSession')
+    @withOutbox
+    def deleteSession(self, request):
+        """Delete a session (conference organizer only); wishlists are
+        cleaned up in the background."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        sess = self._getSessionFromRequest(request)
+        # sessions hang off the conference id, and conferences off their
+        # organizer's profile, so this is the conference only if the user
+        # organizes it
+        conf = ndb.Key(Profile, getUserId(user),
+                       Conference, sess.key.parent().id()).get()
+        if not conf:
+            raise endpoints.ForbiddenException(
+                'Only the conference organizer can delete its sessions.')
+        return BooleanMessage(data=deleteWithTombstone(sess.key, noticeOf(
+            sess, 'sessionDeleted', '%s of %s was cancelled' % (
+                sess.sessionName, conf.name))))
+
     # - - - Session wishlists - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
-    def _sessionRegistration(self, request):
-        """Transaction to register or unregister user for selected session."""
-        retval = None
-        # get user Profile
-        prof = self._getProfileFromUser()
+    def _wishlistQuery(self, prof):
+        """Return the query for a profile's wishlist entries; legacy
+        Profile.sessionKeysToAttend lists are moved to entries by the
+        'wishlists' migration (see mapper.py)."""
+        return WishlistEntry.query(ancestor=prof.key)
 
-        # check if session exists given websafeSessionfKey
-        # get conference; check that it exists
+    @ndb.transactional()
+    def _sessionRegistration(self, prof, sess, reg=True):
+        """Transaction on the Profile entity group to add or remove a
+        session from its wishlist."""
+        wssk = sess.key.urlsafe()
+        e_key = ndb.Key(WishlistEntry, wssk, parent=prof.key)
+        entry = e_key.get()
+
+        if reg:
+            # already wishlisted
+            if entry:
+                return False
+            WishlistEntry(key=e_key, sessionKey=sess.key).put()
+        else:
+            if not entry:
+                return False
+            e_key.delete()
+
+        expireAgenda(prof.key.id())
+        return True
+
+    def _getSessionFromRequest(self, request):
+        """Return the session named by websafeSessionKey; bail if not found."""
         wssk = request.websafeSessionKey
         sess = ndb.Key(urlsafe=wssk).get()
         if not sess:
             raise endpoints.NotFoundException(
                 'No session found with key: %s' % wssk)
-
-        # check if user already registered otherwise add
-        if wssk in prof.conferenceKeysToAttend:
-            raise ConflictException(
-                "You have already registered for this session")
-
-        # check if user already registered
-        if wssk in prof.sessionKeysToAttend:
-            retval = False
-        else:
-            # register user to attend session
-            prof.sessionKeysToAttend.append(wssk)
-            retval = True
-
-        # write things back to the datastore & return
-        prof.put()
-        return BooleanMessage(data=retval)
+        return sess
 
     # Wishlist endpoints
     @endpoints.method(SESS_GET_REQUEST, BooleanMessage,
                       path='wishlist/add', http_method='POST',
                       name='addSessionToWishlist')
+    @rateLimited
     def addSessionToWishlist(self, request):
         """Add session to logged user wishlist by key."""
-        return self._sessionRegistration(request)
+        prof = self._getProfileFromUser()
+        sess = self._getSessionFromRequest(request)
+        return BooleanMessage(data=self._sessionRegistration(prof, sess))
+
+    @endpoints.method(SESS_GET_REQUEST, BooleanMessage,
+                      path='wishlist/remove', http_method='POST',
+                      name='removeSessionFromWishlist')
+    def removeSessionFromWishlist(self, request):
+        """Remove session from logged user wishlist by key."""
+        prof = self._getProfileFromUser()
+        sess = self._getSessionFromRequest(request)
+        return BooleanMessage(
+            data=self._sessionRegistration(prof, sess, reg=False))
 
     @endpoints.method(message_types.VoidMessage, SessionForms,
                       path='wishlist/get', http_method='POST',
@@ -752,14 +1259,64 @@ class ConferenceApi(remote.Service):
         """Get all session of logged user wishlist."""
         # get user profile
         prof = self._getProfileFromUser()
-        sess_keys = [ndb.Key(urlsafe=wssk)
-                     for wssk in prof.sessionKeysToAttend]
-        sessions = ndb.get_multi(sess_keys)
+        entries = self._wishlistQuery(prof).fetch()
+        sessions = getMulti([entry.sessionKey for entry in entries],
+                            'getSessionsInWishlist')
+        sessions = sorted([sess for sess in sessions if sess],
+                          key=self._agendaOrder)
 
         # return set of SessionForms objects per Session
         return SessionForms(items=[self._copySessionToForm(sess)
                             for sess in sessions])
 
+    @staticmethod
+    def _agendaOrder(sess):
+        """Sort key of wishlisted sessions: by start, those without last."""
+        return (sess.startDateTime is None, sess.startDateTime)
+
+    def _renderAgenda(self, prof):
+        """Return the protojson-encoded MyAgendaForm of all wishlisted
+        sessions, by start time, with overlaps flagged."""
+        entries = self._wishlistQuery(prof).fetch()
+        # times are read from the sessions, which may have been
+        # rescheduled or backfilled since they were wishlisted
+        sessions = sorted([sess for sess in ndb.get_multi(
+                               [entry.sessionKey for entry in entries])
+                           if sess], key=self._agendaOrder)
+        conflicts = findConflicts([(sess.key.urlsafe(), sess.startDateTime,
+                                    sess.endDateTime) for sess in sessions])
+
+        items = []
+        for sess in sessions:
+            overlapping = sorted(conflicts.get(sess.key.urlsafe(), []))
+            items.append(AgendaItemForm(
+                session=self._copySessionToForm(sess),
+                conflicts=bool(overlapping),
+                conflictsWith=overlapping))
+        return protojson.encode_message(MyAgendaForm(items=items))
+
+    @endpoints.method(AGENDA_PAGE_REQUEST, MyAgendaForm,
+                      path='wishlist/agenda', http_method='GET',
+                      name='getMyAgenda')
+    def getMyAgenda(self, request):
+        """Return a page of the logged user's wishlisted sessions ordered
+        by start time, flagging sessions that overlap."""
+        prof = self._getProfileFromUser()
+        agenda = protojson.decode_message(MyAgendaForm, getRenderedAgenda(
+            prof.key.id(), lambda: self._renderAgenda(prof)))
+
+        try:
+            offset = int(request.pageToken or 0)
+        except ValueError:
+            raise endpoints.BadRequestException('Invalid pageToken')
+        page_size = min(request.pageSize or AGENDA_PAGE_SIZE,
+                        AGENDA_MAX_PAGE_SIZE)
+        items = agenda.items[offset:offset + page_size]
+        more = offset + page_size < len(agenda.items)
+        return MyAgendaForm(
+            items=items,
+            nextPageToken=str(offset + page_size) if more else None)
+
     @endpoints.method(PROFILE_GET_REQUEST, ProfileForm,
                       path='profiles/{mainEmail}', http_method='POST',
                       name='getProfileByEmail')
@@ -783,14 +1340,9 @@ class ConferenceApi(remote.Service):
                       name='getNextConference')
     def getNextConference(self, request):
         """Get next conference to start from user's current time"""
-        # Query conferences
-        q = Conference.query()
-        # filter away past conferences
-        q = q.filter(Conference.startDate >= datetime.today())
-        # order by date
-        q = q.order(Conference.startDate)
-        # get earliest conference
-        conf = q.get()
+        # upcoming conferences, earliest first, cached in the instance
+        upcoming = getUpcomingConferences()
+        conf = upcoming[0] if upcoming else None
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found')
@@ -801,19 +1353,24 @@ class ConferenceApi(remote.Service):
 
     # One inequality filter at most on one property
     # A property with an inequality filter must be sorted first
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(ARCHIVED_REQUEST, SessionForms,
                       path='sessions/nonworkshops/before7', http_method='POST',
                       name='nonWorkshopsBefore7')
+    @rateLimited
     def nonWorkshopsBefore7(self, request):
         """Get next session to start from current time"""
         # get all sessions
         q = Session.query()
+        if not request.includeArchived:
+            q = onlyUnarchived(q, Session)
         # extract sessions before 7pm
         time = datetime.strptime('19:00', "%H:%M").time()
         q = q.filter(Session.startTime != None)
         q = q.filter(Session.startTime <= time)
         q = q.order(Session.startTime)
         sessions = q.fetch()
+        if not request.includeArchived:
+            sessions = dropArchived(sessions)
         if not sessions:
             raise endpoints.NotFoundException(
                 'No sessions found')
@@ -828,34 +1385,12 @@ class ConferenceApi(remote.Service):
 
     # - - - Featured speaker - - - - - - - - - - - - - - - - - - - -
 
-    @staticmethod
-    def _cacheFeaturedSpeaker(speaker, wsck):
-        """Checks for featured speaker & assign to memcache; used by
-        pull queue.
-        """
-        sessions = Session.query(ancestor=ndb.Key(urlsafe=wsck).get())
-        sessions = sessions.filter(Session.speaker == speaker).fetch()
-
-        if len(sessions) > 1:
-            # If there are repeated speakers,
-            # format speaker and set it in memcache
-            featuredSpeaker = SPEAKER_TPL % (speaker,
-                ', '.join(sess.sessionName for sess in sessions))
-            memcache.set(MEMCACHE_SPEAKER_KEY, featuredSpeaker)
-        else:
-            # If there are no featured speaker,
-            # delete the memcache announcements entry
-            featuredSpeaker = ""
-            memcache.delete(MEMCACHE_SPEAKER_KEY)
-
-        return featuredSpeaker
-
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='session/featuredspeaker/get', http_method='GET',
                       name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
         """Return featured speaker from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_SPEAKER_KEY) or "")
+        return StringMessage(data=getFeaturedSpeaker())
 
 
 api = endpoints.api_server([ConferenceApi])  # register API
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+"""cooccurrence.py
+
+Co-attendance and topic co-occurrence scores behind the conference
+recommendations.
+
+buildModel() streams the registrations of every profile once and counts
+
+- co-attendance: how many profiles registered for both conference a and
+  conference b, normalised by the geometric mean of their attendance
+  (cosine similarity);
+- topic co-occurrence: how many profiles attended conferences on both
+  topic t and topic u, normalised the same way.
+
+Memory is bounded by the number of distinct conference and topic pairs,
+not by the number of profiles, and only the NEIGHBOURS strongest links
+per conference and topic are kept, so the model stays small enough for
+the instance cache. recommend() scores one profile against the model
+without touching the datastore.
+
+Conferences and topics are referred to by their position in the model's
+'keys' and 'topics' lists, which keeps the JSON form small.
+
+Kept free of App Engine imports so the offline tooling can use it.
+
+"""
+
+import collections
+import heapq
+import itertools
+import json
+import math
+
+TOP_N = 10                  # recommendations stored per profile
+NEIGHBOURS = 20             # strongest links kept per conference/topic
+MAX_HISTORY = 50            # most recent registrations looked at
+CANDIDATES_PER_TOPIC = 100  # most attended candidates kept per topic
+AFFINE_TOPICS = 8           # strongest topics scored per profile
+POPULAR = 50                # fallback for profiles without history
+OVERLAP_WEIGHT = 1.0
+TOPIC_WEIGHT = 0.5
+
+
+def _links(pairs, counts, keep, limit):
+    """Return the limit strongest cosine links of every item, as a dict
+    of item -> [[other, weight], ...]; only others passing keep count."""
+    found = collections.defaultdict(list)
+    for (a, b), n in pairs.items():
+        weight = n / math.sqrt(counts[a] * counts[b])
+        if keep(b):
+            found[a].append((weight, b))
+        if keep(a):
+            found[b].append((weight, a))
+    return dict((a, [[b, round(weight, 4)]
+                     for weight, b in heapq.nlargest(limit, links)])
+                for a, links in found.items())
+
+
+def buildModel(histories, conferences, candidates, limit=NEIGHBOURS):
+    """Count co-attendance and topic co-occurrence over histories.
+
+    histories yields the conference keys each profile registered for,
+    oldest first; conferences maps every conference key to its topics and
+    candidates maps the keys that may be recommended to the [name, city,
+    startDate] shown with them. Returns the model as a JSON-serializable
+    dict.
+    """
+    keys = sorted(conferences)
+    index = dict((key, i) for i, key in enumerate(keys))
+    topics = sorted(set(t for ts in conferences.values() for t in ts))
+    topic_index = dict((t, i) for i, t in enumerate(topics))
+    conference_topics = [sorted(set(topic_index[t] for t in conferences[key]))
+                         for key in keys]
+    recommendable = set(index[key] for key in candidates if key in index)
+
+    profiles = 0
+    attendees = collections.Counter()
+    pairs = collections.Counter()
+    topic_profiles = collections.Counter()
+    topic_pairs = collections.Counter()
+    for history in histories:
+        profiles += 1
+        attended = sorted(set(index[key] for key in history[-MAX_HISTORY:]
+                              if key in index))
+        attendees.update(attended)
+        pairs.update(itertools.combinations(attended, 2))
+        seen = sorted(set(t for c in attended for t in conference_topics[c]))
+        topic_profiles.update(seen)
+        topic_pairs.update(itertools.combinations(seen, 2))
+
+    neighbours = _links(pairs, attendees, recommendable.__contains__, limit)
+    topic_links = _links(topic_pairs, topic_profiles, lambda t: True, limit)
+
+    popularity = lambda c: (-attendees[c], c)
+    by_topic = collections.defaultdict(list)
+    for c in recommendable:
+        for t in conference_topics[c]:
+            by_topic[t].append(c)
+
+    return {
+        'profiles': profiles,
+        'keys': keys,
+        'topics': topics,
+        'conferenceTopics': conference_topics,
+        'info': [candidates[key] if index[key] in recommendable else None
+                 for key in keys],
+        'neighbours': [neighbours.get(c, []) for c in range(len(keys))],
+        'topicLinks': [topic_links.get(t, []) for t in range(len(topics))],
+        'byTopic': [sorted(by_topic[t], key=popularity)[:CANDIDATES_PER_TOPIC]
+                    for t in range(len(topics))],
+        'popular': sorted(recommendable, key=popularity)[:POPULAR],
+    }
+
+
+def dumpModel(model):
+    """Serialize a model built by buildModel(), before loadModel()."""
+    return json.dumps(model, separators=(',', ':'))
+
+
+def loadModel(data):
+    """Deserialize a model and index it for recommend()."""
+    model = json.loads(data)
+    model['index'] = dict((key, i) for i, key in enumerate(model['keys']))
+    # a conference shares a topic's weight with its other topics
+    model['byTopic'] = [[(c, 1.0 / len(model['conferenceTopics'][c]))
+                         for c in cs] for cs in model['byTopic']]
+    return model
+
+
+def _item(model, c, score):
+    name, city, start_date = model['info'][c]
+    return {'websafeKey': model['keys'][c], 'name': name, 'city': city,
+            'startDate': start_date, 'score': round(score, 4),
+            'topics': [model['topics'][t]
+                       for t in model['conferenceTopics'][c]]}
+
+
+def recommend(model, history, top_n=TOP_N):
+    """Return the top_n conferences for a profile that registered for the
+    conference keys in history, best first, as dicts of their websafeKey,
+    name, city, startDate, topics and score."""
+    index = model['index']
+    attended = [index[key] for key in history if key in index]
+    recent = attended[-MAX_HISTORY:]
+
+    scores = collections.defaultdict(float)
+    for c in recent:
+        for other, weight in model['neighbours'][c]:
+            scores[other] += OVERLAP_WEIGHT * weight
+
+    seen = set(t for c in recent for t in model['conferenceTopics'][c])
+    affinity = collections.defaultdict(float)
+    for t in seen:
+        affinity[t] += 1.0
+        for other, weight in model['topicLinks'][t]:
+            affinity[other] += weight
+    for t, weight in heapq.nlargest(AFFINE_TOPICS, affinity.items(),
+                                    key=lambda item: item[1]):
+        weight = TOPIC_WEIGHT * weight / len(seen)
+        for c, share in model['byTopic'][t]:
+            scores[c] += weight * share
+
+    for c in attended:
+        scores.pop(c, None)
+    best = heapq.nlargest(top_n, scores.items(),
+                          key=lambda item: (item[1], -item[0]))
+
+    # top up with the most attended conferences, e.g. for new profiles
+    chosen = set(c for c, _ in best) | set(attended)
+    for c in model['popular']:
+        if len(best) >= top_n:
+            break
+        if c not in chosen:
+            best.append((c, 0.0))
+    return [_item(model, c, score) for c, score in best]
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""digests.py
+
+Confirmation e-mail digests built from the confirmation pull queue.
+
+_createConferenceObject() queues one compact task per new conference on
+the pull queue, tagged with the recipient. The digest cron leases them by
+tag, each lease taking every pending task of the recipient with the
+oldest one, up to DIGEST_BATCH_SIZE, and sends a single mail per lease:
+a burst of conferences from one organizer is one mail however it falls
+across cron runs. Kept free of App Engine imports so tools/mail_sink.py
+can measure it offline.
+
+"""
+
+import json
+
+CONFIRMATION_QUEUE = 'confirmation-email'
+DIGEST_LEASE_SECONDS = 60
+DIGEST_BATCH_SIZE = 1000       # the most one lease returns
+# upper bound on mails sent per cron run, i.e. the delivery rate
+DIGEST_MAX_MAILS_PER_RUN = 200
+
+DIGEST_SUBJECT = 'You created a new Conference!'
+DIGEST_SUBJECT_MANY = 'You created %d new Conferences!'
+DIGEST_TPL = 'Hi, you have created the following conference%s:\r\n\r\n%s'
+DIGEST_LINE_TPL = '- %s (%s, %s to %s)'
+
+
+def confirmationPayload(email, wsck):
+    """Return the pull task payload for one created conference."""
+    return json.dumps({'email': email, 'wsck': wsck},
+                      separators=(',', ':'))
+
+
+def groupByRecipient(tasks):
+    """Group leased tasks per recipient; a lease by tag has one, but
+    tasks queued before they were tagged may be mixed.
+
+    Returns {email: [(task, wsck), ...]} preserving lease order, so the
+    tasks of a recipient can be deleted once their digest is sent.
+    """
+    digests = {}
+    for task in tasks:
+        payload = json.loads(task.payload)
+        digests.setdefault(payload['email'], []).append(
+            (task, payload['wsck']))
+    return digests
+
+
+def formatDigest(confs):
+    """Return (subject, body) of a digest listing confs."""
+    lines = [DIGEST_LINE_TPL % (conf.name, conf.city, conf.startDate,
+                                conf.endDate)
+             for conf in confs]
+    if len(confs) == 1:
+        subject = DIGEST_SUBJECT
+    else:
+        subject = DIGEST_SUBJECT_MANY % len(confs)
+    return subject, DIGEST_TPL % ('s' if len(confs) > 1 else '',
+                                  '\r\n'.join(lines))
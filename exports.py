@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+"""exports.py
+
+Attendee roster exports for organizers.
+
+An export resolves the attendees of a conference through the index on
+Profile.conferenceKeysToAttend, a page per task, and writes each page's
+CSV rows (display name, email, tee-shirt size) as one ExportChunk in the
+transaction that checkpoints the cursor and queues the next task, so a
+retried task never writes a page twice. Building holds one page of the
+roster in memory at a time. The download reads the chunks in order, a
+batch at a time, but webapp2 buffers the whole response, so a download
+holds the full CSV and is capped by the runtime's response size limit.
+
+Downloads are authorized by the random token in their URL, which only
+the organizer gets from the API. Exports hold attendees' emails, so they
+are kept for EXPORT_TTL only: the download refuses older ones and
+expireExports, run by cron, deletes them. The purge of a deleted
+conference deletes its exports at once.
+
+"""
+
+import binascii
+import csv
+import logging
+import os
+import StringIO
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import AttendeeExport
+from models import ExportChunk
+from models import Profile
+from models import TeeShirtSize
+from outbox import addOutboxTask
+from outbox import flushOutbox
+
+EXPORT_PAGE_SIZE = 500
+DOWNLOAD_BATCH_SIZE = 10    # chunks fetched at a time while streaming
+DELETE_BATCH_SIZE = 100
+EXPORT_TTL = timedelta(hours=24)
+HEADER = ['displayName', 'mainEmail', 'teeShirtSize']
+
+
+def _queueStep(e_key, number):
+    """Queue step number of an export; call inside its checkpoint."""
+    addOutboxTask(e_key, 'step-%d' % number, url='/tasks/export_attendees',
+                  params={'export': e_key.urlsafe(), 'step': str(number)})
+
+
+def startExport(user_id, wsck):
+    """Start exporting the attendees of wsck for its organizer user_id;
+    returns the AttendeeExport."""
+    export = AttendeeExport(parent=ndb.Key(Profile, user_id),
+                            websafeConferenceKey=wsck,
+                            token=binascii.hexlify(os.urandom(16)))
+
+    @ndb.transactional()
+    def _txn():
+        export.put()
+        _queueStep(export.key, 0)
+    _txn()
+    return export
+
+
+def _teeShirtSize(prof):
+    try:
+        return str(TeeShirtSize(prof.teeShirtSize))
+    except TypeError:
+        return str(TeeShirtSize.NOT_SPECIFIED)
+
+
+def _csv(rows):
+    out = StringIO.StringIO()
+    writer = csv.writer(out)
+    for row in rows:
+        writer.writerow([(value or '').encode('utf-8') for value in row])
+    return out.getvalue()
+
+
+@ndb.transactional()
+def _checkpoint(e_key, number, cursor, data, rows):
+    """Store the chunk of a step and queue the next one, unless the step
+    was already recorded by an earlier run of the same task."""
+    export = e_key.get()
+    if not export or export.steps != number:
+        return None
+    export.steps += 1
+    export.cursor = cursor.urlsafe() if cursor else None
+    export.rows += rows
+    if not cursor:
+        export.done = True
+        export.finished = datetime.now()
+    ExportChunk(parent=e_key, id=export.steps, data=data).put()
+    export.put()
+    if not export.done:
+        _queueStep(e_key, export.steps)
+    return export
+
+
+def runStep(e_key, number):
+    """Write the next page of an export's rows."""
+    export = e_key.get()
+    if not export or export.done or export.steps != number:
+        logging.info('Dropping stale step %d of export %s', number, e_key)
+        return
+
+    cursor = Cursor(urlsafe=export.cursor) if export.cursor else None
+    profiles, next_cursor, more = Profile.query(
+        Profile.conferenceKeysToAttend == export.websafeConferenceKey
+    ).fetch_page(EXPORT_PAGE_SIZE, start_cursor=cursor)
+    rows = [[prof.displayName, prof.mainEmail, _teeShirtSize(prof)]
+            for prof in profiles]
+    data = _csv(([HEADER] if number == 0 else []) + rows)
+
+    export = _checkpoint(e_key, number, next_cursor if more else None,
+                         data, len(rows))
+    if export:
+        flushOutbox()
+        if export.done:
+            logging.info('Exported %d attendees of %s at %.0f rows/s',
+                         export.rows, export.websafeConferenceKey,
+                         rowsPerSecond(export) or 0)
+
+
+def rowsPerSecond(export):
+    """Return the build throughput of a finished export, else None."""
+    if not export.finished:
+        return None
+    elapsed = (export.finished - export.started).total_seconds()
+    return round(export.rows / elapsed, 1) if elapsed else None
+
+
+def expired(export):
+    return export.started < datetime.now() - EXPORT_TTL
+
+
+def downloadUrl(export):
+    return '/exports/%s/%s.csv' % (export.key.urlsafe(), export.token)
+
+
+def streamExport(export, write):
+    """Pass the CSV of a finished export to write, a chunk at a time.
+    Returns False if the export was deleted while it was being read."""
+    for first in range(1, export.steps + 1, DOWNLOAD_BATCH_SIZE):
+        last = min(first + DOWNLOAD_BATCH_SIZE, export.steps + 1)
+        for chunk in ndb.get_multi([ndb.Key(ExportChunk, n, parent=export.key)
+                                    for n in range(first, last)]):
+            if not chunk:
+                return False
+            write(chunk.data)
+    return True
+
+
+def deleteExports(e_keys):
+    """Delete exports and their chunks."""
+    # the exports go first: a step still running then finds its export
+    # gone in the checkpoint and writes no further chunk
+    ndb.delete_multi(e_keys)
+    for e_key in e_keys:
+        while True:
+            c_keys = ExportChunk.query(ancestor=e_key).fetch(
+                DELETE_BATCH_SIZE, keys_only=True)
+            if not c_keys:
+                break
+            ndb.delete_multi(c_keys)
+
+
+def expireExports():
+    """Delete the exports started more than EXPORT_TTL ago; returns how
+    many were deleted."""
+    q = AttendeeExport.query(
+        AttendeeExport.started < datetime.now() - EXPORT_TTL)
+    deleted, cursor, more = 0, None, True
+    while more:
+        e_keys, cursor, more = q.fetch_page(
+            DELETE_BATCH_SIZE, keys_only=True, start_cursor=cursor)
+        deleteExports(e_keys)
+        deleted += len(e_keys)
+    return deleted
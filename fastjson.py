@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+"""fastjson.py
+
+Opt-in fast JSON path for the large public list endpoints.
+
+The endpoints path builds a ConferenceForm/SessionForm message per row,
+validates it and encodes it generically. The handlers here run the same
+queries but write JSON straight from the entities, using a key layout
+precomputed once per form class, and keep each entity's serialized
+fragment in an in-instance cache keyed by its key and revision. The
+output matches the endpoints response body for the same request, except
+that unset dates are left out instead of being sent as "None".
+
+    POST /fast/queryConferences                      (ConferenceQueryForms)
+    GET  /fast/conference/<websafeConferenceKey>/sessions
+    GET  /fast/catalog                               (see catalog.py)
+
+"""
+
+import collections
+import json
+import threading
+
+import endpoints
+import webapp2
+from protorpc import messages
+from protorpc import protojson
+
+from catalog import getCatalog
+from conference import ConferenceApi
+from conference import formMapper
+from models import ConferenceForm
+from models import ConferenceQueryForms
+from models import SessionForm
+from ratelimit import checkRate
+
+FRAGMENT_CACHE_SIZE = 5000
+
+_layouts = {}
+_fragments = collections.OrderedDict()
+_fragments_lock = threading.Lock()     # requests run in threads
+
+
+def _layout(form_cls):
+    """Return [(json key prefix, property name, encoder)] for form_cls."""
+    layout = _layouts.get(form_cls)
+    if layout is None:
+        layout = []
+        for name, as_string in formMapper(form_cls):
+            field = form_cls.field_by_name(name)
+            if as_string or isinstance(field, messages.StringField):
+                encode = lambda value: json.dumps(
+                    value if isinstance(value, basestring) else str(value))
+            elif (isinstance(field, messages.IntegerField) and
+                  field.variant in (messages.Variant.INT64,
+                                    messages.Variant.UINT64)):
+                # endpoints quotes 64 bit integers for JavaScript clients
+                encode = lambda value: '"%d"' % value
+            else:
+                encode = json.dumps
+            if field.repeated:
+                encode = (lambda item: lambda values: '[%s]' % ','.join(
+                    item(v) for v in values))(encode)
+            layout.append(('"%s":' % name, name, encode))
+        _layouts[form_cls] = layout
+    return layout
+
+
+def _fragment(entity, form_cls):
+    """Return entity encoded as an unterminated JSON object, cached per
+    entity revision."""
+    urlsafe = entity.key.urlsafe()
+    # conferences count every write, registrations included, in revision
+    cache_key = (urlsafe, getattr(entity, 'revision', entity.version))
+    with _fragments_lock:
+        fragment = _fragments.pop(cache_key, None)
+    if fragment is None:
+        parts = []
+        for prefix, name, encode in _layout(form_cls):
+            value = getattr(entity, name)
+            if value is None or value == []:
+                continue
+            parts.append(prefix + encode(value))
+        parts.append('"websafeKey":' + json.dumps(urlsafe))
+        fragment = '{' + ','.join(parts)
+    with _fragments_lock:
+        while len(_fragments) >= FRAGMENT_CACHE_SIZE:
+            _fragments.popitem(last=False)
+        _fragments[cache_key] = fragment
+    return fragment
+
+
+def encodeConferences(confs, names):
+    """Return the ConferenceForms JSON body for confs."""
+    items = []
+    for conf in confs:
+        fragment = _fragment(conf, ConferenceForm)
+        name = names.get(conf.organizerUserId)
+        if name:
+            fragment += ',"organizerDisplayName":' + json.dumps(name)
+        items.append(fragment + '}')
+    return '{"items":[%s]}' % ','.join(items)
+
+
+def encodeSessions(sessions):
+    """Return the SessionForms JSON body for sessions."""
+    return '{"items":[%s]}' % ','.join(
+        _fragment(sess, SessionForm) + '}' for sess in sessions)
+
+
+class FastJsonHandler(webapp2.RequestHandler):
+    def handle_exception(self, exception, debug):
+        if isinstance(exception, endpoints.ServiceException):
+            status = getattr(exception, 'fastStatus', exception.http_status)
+            if getattr(exception, 'retryAfter', None):
+                self.response.headers['Retry-After'] = str(
+                    exception.retryAfter)
+        elif isinstance(exception, messages.Error):
+            status = 400
+        else:
+            raise exception
+        self._write({'error': {'message': str(exception)}}, status)
+
+    def _write(self, body, status=200):
+        # webapp2 takes its reason phrases from httplib, which lacks 429
+        self.response.set_status(
+            status, 'Too Many Requests' if status == 429 else None)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(body if isinstance(body, basestring)
+                            else json.dumps(body))
+
+
+class QueryConferencesHandler(FastJsonHandler):
+    def post(self):
+        """queryConferences, encoded directly from the entities."""
+        checkRate('queryConferences', 'ip:%s' % self.request.remote_addr)
+        api = ConferenceApi()
+        request = protojson.decode_message(ConferenceQueryForms,
+                                           self.request.body or '{}')
+        confs = api._fetchConferences(request)
+        self._write(encodeConferences(confs, api._organizerNames(confs)))
+
+
+class ConferenceSessionsHandler(FastJsonHandler):
+    def get(self, wsck):
+        """getConferenceSessions, encoded directly from the entities."""
+        sessions = ConferenceApi()._conferenceSessions(wsck)
+        self._write(encodeSessions(sessions))
+
+
+class CatalogHandler(FastJsonHandler):
+    MAX_AGE = 60
+
+    def get(self):
+        """The public catalog snapshot, revalidated by ETag."""
+        catalog = getCatalog()
+        if not catalog:
+            # being built; the client falls back to queryConferences
+            self.response.headers['Retry-After'] = '10'
+            self._write({'error': {'message': 'The catalog is being built'}},
+                        503)
+            return
+        etag, data = catalog
+        self.response.headers['ETag'] = etag
+        self.response.headers['Cache-Control'] = (
+            'public, max-age=%d' % self.MAX_AGE)
+        if self.request.headers.get('If-None-Match') == etag:
+            self.response.set_status(304)
+            return
+        self._write(data)
+
+
+app = webapp2.WSGIApplication([
+    ('/fast/queryConferences', QueryConferencesHandler),
+    (r'/fast/conference/([^/]+)/sessions', ConferenceSessionsHandler),
+    ('/fast/catalog', CatalogHandler),
+], debug=True)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""indexes.py
+
+Conference query shapes and the composite indexes needed to serve them.
+
+A query shape is the set of equality-filtered properties plus the (at most
+one) inequality-filtered property of a queryConferences() request. Rather
+than one composite index per combination of filters, the datastore can
+zig-zag merge-join one small index per equality property as long as every
+index ends with the same sort suffix (inequality property, then name).
+Anything not covered by an index falls back to in-memory merging in
+conference.py.
+
+Kept free of App Engine imports so the offline tooling can use it.
+
+"""
+
+import itertools
+import re
+
+SORT_PROPERTY = 'name'
+
+SHAPE_LOG_PREFIX = 'Conference query shape:'
+SHAPE_RE = re.compile(r'eq=(?P<eq>[\w,]*) ineq=(?P<ineq>\w*)')
+
+
+def queryShape(inequality_field, filters):
+    """Return (equality properties, inequality property) for filters."""
+    equalities = sorted(set(
+        f['field'] for f in filters
+        if f['operator'] == '=' and f['field'] != inequality_field))
+    return (tuple(equalities), inequality_field or None)
+
+
+def formatShape(shape):
+    """Format a shape the way it is logged and read back by parseShape()."""
+    equalities, inequality = shape
+    return '%s eq=%s ineq=%s' % (SHAPE_LOG_PREFIX, ','.join(equalities),
+                                 inequality or '')
+
+
+def parseShape(line):
+    """Parse a shape from a formatShape() line; None if there is none."""
+    match = SHAPE_RE.search(line)
+    if not match:
+        return None
+    equalities = tuple(sorted(p for p in match.group('eq').split(',') if p))
+    return (equalities, match.group('ineq') or None)
+
+
+def sortSuffix(inequality):
+    """Return the sort order shared by every index serving a shape."""
+    if inequality:
+        return (inequality, SORT_PROPERTY)
+    return (SORT_PROPERTY,)
+
+
+def mergeIndexes(shape, inequality_composites=True):
+    """Return the set of indexes a zig-zag merge join needs for shape.
+
+    Each equality property gets its own index ending in the shared sort
+    suffix. With inequality_composites=False, shapes with an inequality
+    are left to the in-memory fallback instead of getting indexes.
+    """
+    equalities, inequality = shape
+    if inequality and not inequality_composites:
+        return set()
+    suffix = sortSuffix(inequality)
+    needed = set((prop,) + suffix for prop in equalities)
+    if not equalities and len(suffix) > 1:
+        needed.add(suffix)
+    return needed
+
+
+def minimalIndexes(shapes, inequality_composites=True):
+    """Return the sorted union of merge-join indexes for shapes."""
+    needed = set()
+    for shape in shapes:
+        needed |= mergeIndexes(shape, inequality_composites)
+    return sorted(needed, key=lambda props: (len(props), props))
+
+
+def allShapes(fields):
+    """Enumerate every shape queryConferences() can produce over fields."""
+    shapes = set()
+    for inequality in [None] + list(fields):
+        others = [f for f in fields if f != inequality]
+        for n in range(len(others) + 1):
+            for equalities in itertools.combinations(sorted(others), n):
+                if equalities or inequality:
+                    shapes.add((equalities, inequality))
+    return sorted(shapes, key=lambda shape: (shape[0], shape[1] or ''))
+
+
+def indexRows(props, values_per_property):
+    """Number of index rows a single entity contributes to an index."""
+    rows = 1
+    for prop in props:
+        rows *= values_per_property.get(prop, 1)
+    return rows
+
+
+def writeCost(indexes, properties, values_per_property):
+    """Estimate datastore write operations for one new Conference put.
+
+    Uses the classic billing model: 2 for the entity and kind index,
+    2 per built-in (ascending and descending) value of each indexed
+    property, plus 1 per composite index row.
+    """
+    ops = 2
+    for prop in properties:
+        ops += 2 * values_per_property.get(prop, 1)
+    for props in indexes:
+        ops += indexRows(props, values_per_property)
+    return ops
+
+
+def parseIndexYaml(text, kind):
+    """Return the property tuples of the composite indexes for kind.
+
+    Only understands the flat layout written by dev_appserver; enough to
+    read index.yaml without depending on PyYAML.
+    """
+    indexes = []
+    current_kind, props = None, None
+    for line in text.splitlines():
+        stripped = line.split('#', 1)[0].strip()
+        if stripped.startswith('- kind:'):
+            if current_kind == kind and props:
+                indexes.append(tuple(props))
+            current_kind = stripped.split(':', 1)[1].strip()
+            props = []
+        elif stripped.startswith('- name:') and props is not None:
+            props.append(stripped.split(':', 1)[1].strip())
+    if current_kind == kind and props:
+        indexes.append(tuple(props))
+    return indexes
+
+
+def _indexEntries(kind, indexes, comments):
+    """Return the index.yaml lines of indexes, each preceded by its
+    comment, if any, and followed by a blank line."""
+    lines = []
+    for props in indexes:
+        if props in comments:
+            lines.extend('# %s' % line
+                         for line in comments[props].split('\n'))
+        lines.append('- kind: %s' % kind)
+        lines.append('  properties:')
+        for prop in props:
+            lines.append('  - name: %s' % prop)
+        lines.append('')
+    return lines
+
+
+def formatIndexYaml(kind, indexes, comments=None):
+    """Render composite indexes for kind as index.yaml text."""
+    return '\n'.join(['indexes:', ''] +
+                     _indexEntries(kind, indexes, comments or {}))
+
+
+def mergeIndexYaml(text, kind, indexes, comments=None):
+    """Replace the composite indexes for kind in index.yaml text with
+    indexes, keeping the entries of other kinds, the comments between
+    entries and the AUTOGENERATED section as they are.
+
+    An entry runs from the comment lines right above its "- kind:" line
+    to the next line that is not indented; the new entries go where the
+    first old one for kind was, else above the AUTOGENERATED marker.
+    """
+    lines = text.splitlines()
+    kept, at = [], None
+    i = 0
+    while i < len(lines):
+        start = i
+        while i < len(lines) and lines[i].startswith('#'):
+            i += 1
+        if i == len(lines) or not lines[i].startswith('- kind:'):
+            kept.extend(lines[start:i + 1])
+            i += 1
+            continue
+        entry_kind = lines[i].split(':', 1)[1].strip()
+        i += 1
+        while i < len(lines) and lines[i].startswith(' '):
+            i += 1
+        if entry_kind != kind:
+            kept.extend(lines[start:i])
+            continue
+        if at is None:
+            at = len(kept)
+        # with the blank line that separates it from the next entry
+        if i < len(lines) and not lines[i].strip():
+            i += 1
+    if at is None:
+        at = (kept.index('# AUTOGENERATED') if '# AUTOGENERATED' in kept
+              else len(kept))
+    kept[at:at] = _indexEntries(kind, indexes, comments or {})
+    return '\n'.join(kept) + '\n'
@@ -12,39 +12,370 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import logging
 import webapp2
-from google.appengine.api import app_identity
-from google.appengine.api import mail
-from conference import ConferenceApi
+from caches import cacheAnnouncement
+from caches import cacheFeaturedSpeaker
+from caches import getAnnouncement
+from caches import getUpcomingConferences
+
+# Handlers import only what they use; mail, task queue and the endpoints
+# service are loaded lazily by the (rare) requests that need them, which
+# keeps instance start-up cheap.
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Load the API and prime in-instance caches before serving."""
+        import conference       # builds the endpoints service
+        conference.primeFormMappers()
+        getAnnouncement()
+        getUpcomingConferences()
+        self.response.set_status(200)
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
         """Set Announcement in Memcache."""
-        ConferenceApi._cacheAnnouncement()
+        cacheAnnouncement()
+        self.response.set_status(204)
+
+class FlushOutboxHandler(webapp2.RequestHandler):
+    def get(self):
+        """Re-flush outbox tasks that were not queued by their request."""
+        from outbox import sweepOutbox
+        flushed = sweepOutbox()
+        if flushed:
+            logging.info('Flushed %d stale outbox tasks', flushed)
         self.response.set_status(204)
 
 class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
         """Set FeaturedSpeaker in Memcache."""
-        ConferenceApi._cacheFeaturedSpeaker(self.request.get('speaker'), self.request.get('wsck'))
+        cacheFeaturedSpeaker(self.request.get('speaker'), self.request.get('wsck'))
+        self.response.set_status(204)
+
+class SendConfirmationDigestsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Lease confirmation tasks by recipient and mail each one
+        digest."""
+        from google.appengine.api import app_identity
+        from google.appengine.api import mail
+        from google.appengine.api import taskqueue
+        from google.appengine.ext import ndb
+        from digests import CONFIRMATION_QUEUE
+        from digests import DIGEST_BATCH_SIZE
+        from digests import DIGEST_LEASE_SECONDS
+        from digests import DIGEST_MAX_MAILS_PER_RUN
+        from digests import formatDigest
+        from digests import groupByRecipient
+
+        queue = taskqueue.Queue(CONFIRMATION_QUEUE)
+        sender = 'noreply@%s.appspotmail.com' % (
+            app_identity.get_application_id())
+        sent = 0
+        while sent < DIGEST_MAX_MAILS_PER_RUN:
+            # all pending tasks of the recipient of the oldest one
+            tasks = queue.lease_tasks_by_tag(DIGEST_LEASE_SECONDS,
+                                             DIGEST_BATCH_SIZE)
+            if not tasks:
+                break
+            digests = groupByRecipient(tasks)
+            confs = ndb.get_multi([ndb.Key(urlsafe=wsck)
+                                   for entries in digests.values()
+                                   for _, wsck in entries])
+            confs = dict((conf.key.urlsafe(), conf)
+                         for conf in confs if conf)
+
+            for email, entries in digests.items():
+                if sent >= DIGEST_MAX_MAILS_PER_RUN:
+                    # leave the rest leased; it is retried once the lease expires
+                    break
+                found = [confs[wsck] for _, wsck in entries if wsck in confs]
+                if found:
+                    subject, body = formatDigest(found)
+                    mail.send_mail(sender, email, subject, body)
+                    sent += 1
+                queue.delete_tasks([task for task, _ in entries])
+
+        logging.info('Sent %d confirmation digests', sent)
+        self.response.set_status(204)
+
+
+class ReputHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start re-putting every entity of ?kind=, e.g. to backfill
+        derived or newly added properties."""
+        from mapper import startJob
+        try:
+            job = startJob(self.request.get('kind'), 'reput')
+        except ValueError as e:
+            self.abort(400, str(e))
+        self.redirect('/tasks/mapper/status?job=%d' % job.key.id())
+
+
+class MapperHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start a mapper job applying ?op= to every entity of ?kind=,
+        in ?shards= parallel key ranges."""
+        from mapper import DEFAULT_SHARDS
+        from mapper import startJob
+        try:
+            job = startJob(self.request.get('kind'), self.request.get('op'),
+                           int(self.request.get('shards', DEFAULT_SHARDS)))
+        except ValueError as e:
+            self.abort(400, str(e))
+        self.redirect('/tasks/mapper/status?job=%d' % job.key.id())
+
+    def post(self):
+        """Run one slice of a mapper job shard."""
+        from mapper import runSlice
+        runSlice(int(self.request.get('job')), int(self.request.get('shard')),
+                 int(self.request.get('slice')))
         self.response.set_status(204)
 
-class SendConfirmationEmailHandler(webapp2.RequestHandler):
+
+class RunMigrationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start pending deploy migrations and record finished ones."""
+        import json
+        from mapper import runMigrations
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(runMigrations()))
+
+
+class MapperStatusHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the progress and throughput of mapper job ?job=."""
+        import json
+        from mapper import jobStatus
+        status = jobStatus(int(self.request.get('job') or 0))
+        if not status:
+            self.abort(404)
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(status))
+
+
+class RateLimitsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the rate limits and the calls and rejections counted."""
+        import json
+        from ratelimit import rateStats
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(rateStats()))
+
+
+class BuildCatalogHandler(webapp2.RequestHandler):
+    def get(self):
+        """Materialize a new generation of the public catalog."""
+        from catalog import buildCatalog
+        etag, _ = buildCatalog()
+        logging.info('Built catalog %s', etag)
+        self.response.set_status(204)
+
+
+class BuildRecommendationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Rebuild the recommendation model, then start scoring every
+        profile; cron entry point."""
+        import time
+        from google.appengine.api import taskqueue
+        from recommendations import rebuildModel
+        began = time.time()
+        model = rebuildModel()
+        logging.info('Built recommendation model from %d profiles and '
+                     '%d conferences in %.1fs', model['profiles'],
+                     len(model['keys']), time.time() - began)
+        taskqueue.add(url='/crons/build_recommendations')
+        self.response.set_status(204)
+
+    def post(self):
+        """Score one page of profiles and chain the next."""
+        from google.appengine.api import taskqueue
+        from google.appengine.datastore.datastore_query import Cursor
+        from recommendations import scoreProfiles
+        cursor = None
+        if self.request.get('cursor'):
+            cursor = Cursor(urlsafe=self.request.get('cursor'))
+        scored, next_cursor, more = scoreProfiles(cursor)
+        if more and next_cursor:
+            taskqueue.add(url='/crons/build_recommendations',
+                          params={'cursor': next_cursor.urlsafe()})
+        else:
+            logging.info('Scored the last %d profiles', scored)
+        self.response.set_status(204)
+
+
+class RefreshRecommendationsHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
-        mail.send_mail(
-            'noreply@%s.appspotmail.com' % (
-                app_identity.get_application_id()),     # from
-            self.request.get('email'),                  # to
-            'You created a new Conference!',            # subj
-            'Hi, you have created a following '         # body
-            'conference:\r\n\r\n%s' % self.request.get(
-                'conferenceInfo')
-        )
+        """Re-score the profile of a user that just (un)registered."""
+        from recommendations import refreshProfile
+        refreshProfile(self.request.get('user'))
+        self.response.set_status(204)
+
+
+class ReconcileSeatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start a seat audit, repairing what it finds unless ?repair=0;
+        cron entry point."""
+        from reconcile import startAudit
+        audit = startAudit(self.request.get('repair') != '0')
+        self.response.write('Seat audit %d started' % audit.key.id())
+
+    def post(self):
+        """Run one step of a seat audit."""
+        from reconcile import runStep
+        runStep(int(self.request.get('audit')), int(self.request.get('step')))
+        self.response.set_status(204)
+
+
+class SeatAuditStatusHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the progress and discrepancies of seat audit ?audit=."""
+        import json
+        from reconcile import auditStatus
+        status = auditStatus(int(self.request.get('audit') or 0))
+        if not status:
+            self.abort(404)
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(status))
+
+
+class PurgeHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run one step of purging a deleted conference or session."""
+        from google.appengine.ext import ndb
+        from purge import runStep
+        runStep(ndb.Key(urlsafe=self.request.get('tombstone')),
+                int(self.request.get('step')))
+        self.response.set_status(204)
+
+
+class NotifyHandler(webapp2.RequestHandler):
+    def post(self):
+        """Fan a notice out to one page of a conference's attendees or
+        of its sessions' wishlisters."""
+        import json
+        from google.appengine.datastore.datastore_query import Cursor
+        from notifications import fanOut
+        cursor = None
+        if self.request.get('cursor'):
+            cursor = Cursor(urlsafe=self.request.get('cursor'))
+        fanOut(json.loads(self.request.get('notice')),
+               self.request.get('wsck'), cursor,
+               int(self.request.get('page') or 0),
+               self.request.get('phase') or 'attendees')
+        self.response.set_status(204)
+
+
+class DeliverNotificationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Write a notice to the inboxes of one batch of users."""
+        import json
+        from notifications import deliver
+        batch = json.loads(self.request.body)
+        delivered = deliver(batch['notice'], batch['users'])
+        logging.info('Delivered %s to %d of %d users', batch['notice']['id'],
+                     delivered, len(batch['users']))
+        self.response.set_status(204)
+
+
+class BenchReadsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Compare read policy latencies under concurrent registration-like
+        writes, on scratch entities; ?seconds= per policy."""
+        import json
+        from reads import benchmark
+        results = benchmark(seconds=int(self.request.get('seconds') or 10))
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(results, indent=2, sort_keys=True))
+
+
+class ArchiveConferencesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Archive ended conferences; cron entry point."""
+        self.post()
+
+    def post(self):
+        """Archive one batch of ended conferences and chain the next."""
+        from google.appengine.api import taskqueue
+        from archival import archiveEndedConferences
+        archived, more = archiveEndedConferences()
+        logging.info('Archived %d conferences', archived)
+        if more:
+            taskqueue.add(url='/crons/archive_conferences')
+        self.response.set_status(204)
+
+
+class ExportAttendeesHandler(webapp2.RequestHandler):
+    def post(self):
+        """Write one page of an attendee export."""
+        from google.appengine.ext import ndb
+        from exports import runStep
+        runStep(ndb.Key(urlsafe=self.request.get('export')),
+                int(self.request.get('step')))
+        self.response.set_status(204)
+
+
+class DownloadExportHandler(webapp2.RequestHandler):
+    def get(self, websafe_key, token):
+        """Stream the CSV of a finished attendee export."""
+        from google.appengine.ext import ndb
+        import hmac
+        from exports import expired
+        from exports import streamExport
+        from models import AttendeeExport
+        try:
+            e_key = ndb.Key(urlsafe=websafe_key)
+        except Exception:
+            # malformed keys raise any of several decode errors
+            self.abort(404)
+        export = e_key.get() if e_key.kind() == AttendeeExport.__name__ \
+            else None
+        if not export or not hmac.compare_digest(str(export.token),
+                                                 str(token)):
+            self.abort(404)
+        if expired(export):
+            self.abort(410)
+        if not export.done:
+            self.abort(409)
+        self.response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+        self.response.headers['Cache-Control'] = 'private, no-store'
+        self.response.headers['Content-Disposition'] = \
+            'attachment; filename=attendees.csv'
+        if not streamExport(export, self.response.out.write):
+            # expired or purged mid-read; the partial body is discarded
+            self.abort(410)
+
+
+class ExpireExportsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete attendee exports past their expiry."""
+        from exports import expireExports
+        logging.info('Deleted %d expired attendee exports', expireExports())
+        self.response.set_status(204)
 
 
 app = webapp2.WSGIApplication([
+    ('/_ah/warmup', WarmupHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/check_speaker', SetFeaturedSpeakerHandler),
-    ('/tasks/send_confirmation_email', SendConfirmationEmailHandler)
+    ('/tasks/purge', PurgeHandler),
+    ('/tasks/notify', NotifyHandler),
+    ('/tasks/notify/deliver', DeliverNotificationsHandler),
+    ('/tasks/export_attendees', ExportAttendeesHandler),
+    (r'/exports/([^/]+)/([0-9a-f]+)\.csv', DownloadExportHandler),
+    ('/crons/expire_exports', ExpireExportsHandler),
+    ('/crons/send_confirmation_digests', SendConfirmationDigestsHandler),
+    ('/crons/flush_outbox', FlushOutboxHandler),
+    ('/tasks/reput', ReputHandler),
+    ('/tasks/mapper', MapperHandler),
+    ('/tasks/mapper/status', MapperStatusHandler),
+    ('/crons/run_migrations', RunMigrationsHandler),
+    ('/tasks/bench_reads', BenchReadsHandler),
+    ('/tasks/rate_limits', RateLimitsHandler),
+    ('/crons/archive_conferences', ArchiveConferencesHandler),
+    ('/crons/reconcile_seats', ReconcileSeatsHandler),
+    ('/crons/reconcile_seats/status', SeatAuditStatusHandler),
+    ('/crons/build_catalog', BuildCatalogHandler),
+    ('/crons/build_recommendations', BuildRecommendationsHandler),
+    ('/tasks/refresh_recommendations', RefreshRecommendationsHandler)
 ], debug=True)
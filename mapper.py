@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+
+"""mapper.py
+
+Cursor-chained batch jobs for migrations and backfills.
+
+startJob() splits the keys of a kind into shards, sampled through the
+__scatter__ property, and queues one task per shard. Each task (a
+"slice") fetches one page of keys of its key range and applies the
+job's operation to them an entity group at a time, each in a
+transaction that reads the entities afresh, so that a write landing
+while the slice runs (a registration, say) is never overwritten; the
+groups' transactions run concurrently. The slice then checkpoints the
+shard's cursor and counters and queues the next slice in one transaction
+through the outbox, so a shard never runs two slices at once and a
+retried slice is recognised by its number and dropped.
+
+A slice whose entities were written but whose checkpoint failed runs
+again, so operations must be idempotent. Add one by decorating a
+function of the entities of one entity group, returning the entities to
+write, which must belong to the same group:
+
+    @operation('Conference')
+    def conferenceMonth(confs):
+        ...
+
+Migrations that a deploy depends on are listed in MIGRATIONS; the
+/crons/run_migrations cron starts their jobs and records when all of
+them are done, which code reading the backfilled data checks with
+migrationDone().
+
+"""
+
+import collections
+import logging
+import time
+from datetime import datetime
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import models
+from caches import expireAgenda
+from models import MapperJob
+from models import MapperShard
+from models import Migration
+from models import WishlistEntry
+from outbox import addOutboxTask
+from outbox import flushOutbox
+
+PAGE_SIZE = 200
+DEFAULT_SHARDS = 4
+MAX_SHARDS = 32
+OVERSAMPLE = 32             # scatter keys sampled per shard
+
+MIGRATION_RECHECK = 60      # seconds before a pending migration is re-read
+
+OPERATIONS = {}
+
+# name -> [(kind, operation)] run once after the deploy introducing them
+MIGRATIONS = [
+    # entities written before Conference/Session.archived existed lack it
+    ('archived', [('Conference', 'reput'), ('Session', 'reput')]),
+    ('wishlists', [('Profile', 'moveWishlists')]),
+]
+
+_migrated = set()
+_migration_checked = {}     # name -> time a pending migration was read
+
+
+def operation(*kinds):
+    """Register a function as the operation of that name for kinds."""
+    def register(func):
+        OPERATIONS[func.__name__] = (kinds, func)
+        return func
+    return register
+
+
+@operation('Conference', 'Session', 'Profile')
+def reput(entities):
+    """Write entities back unchanged, e.g. so that put hooks and newly
+    added property defaults are stored."""
+    return entities
+
+
+@operation('Conference')
+def conferenceMonth(confs):
+    """Backfill Conference.month from startDate."""
+    changed = []
+    for conf in confs:
+        month = conf.startDate.month if conf.startDate else 0
+        if conf.month != month:
+            conf.month = month
+            changed.append(conf)
+    return changed
+
+
+@operation('Profile')
+def moveWishlists(profiles):
+    """Move the keys left in legacy Profile.sessionKeysToAttend lists to
+    WishlistEntry children."""
+    changed = []
+    for prof in profiles:
+        if not prof.sessionKeysToAttend:
+            continue
+        e_keys = [ndb.Key(WishlistEntry, wssk, parent=prof.key)
+                  for wssk in prof.sessionKeysToAttend]
+        changed.extend(WishlistEntry(key=e_key,
+                                     sessionKey=ndb.Key(urlsafe=e_key.id()))
+                       for e_key, entry in zip(e_keys, ndb.get_multi(e_keys))
+                       if not entry)
+        prof.sessionKeysToAttend = []
+        changed.append(prof)
+        expireAgenda(prof.key.id())
+    return changed
+
+
+def _splitKeys(model, shards):
+    """Return the shards + 1 boundaries of key ranges of similar size;
+    the first and last are None (unbounded)."""
+    if shards <= 1:
+        return [None, None]
+    sample = model.query().order(ndb.GenericProperty('__scatter__')).fetch(
+        shards * OVERSAMPLE, keys_only=True)
+    sample.sort()
+    splits = []
+    for i in range(1, shards):
+        if sample:
+            split = sample[len(sample) * i // shards]
+            if split not in splits:
+                splits.append(split)
+    return [None] + splits + [None]
+
+
+def _shardQuery(model, shard):
+    q = model.query()
+    if shard.lo:
+        q = q.filter(model.key >= shard.lo)
+    if shard.hi:
+        q = q.filter(model.key < shard.hi)
+    return q.order(model.key)
+
+
+def _queueSlice(shard_key, number):
+    """Queue slice number of a shard; call inside the checkpoint."""
+    addOutboxTask(shard_key, 'slice-%d' % number, url='/tasks/mapper',
+                  params={'job': str(shard_key.parent().id()),
+                          'shard': str(shard_key.id()),
+                          'slice': str(number)})
+
+
+def startJob(kind, op, shards=DEFAULT_SHARDS):
+    """Start applying operation op to every entity of kind; returns the
+    MapperJob. Raises ValueError for an unknown kind or operation."""
+    if op not in OPERATIONS or kind not in OPERATIONS[op][0]:
+        raise ValueError('%s is not an operation on %s' % (op, kind))
+    shards = max(1, min(shards, MAX_SHARDS))
+    bounds = _splitKeys(getattr(models, kind), shards)
+
+    job = MapperJob(kind=kind, operation=op, shards=len(bounds) - 1)
+    job.put()
+
+    @ndb.transactional()
+    def _txn(number, lo, hi):
+        shard = MapperShard(parent=job.key, id=number, lo=lo, hi=hi)
+        shard.put()
+        _queueSlice(shard.key, 0)
+
+    for number in range(len(bounds) - 1):
+        _txn(number, bounds[number], bounds[number + 1])
+    flushOutbox()
+    logging.info('Mapper job %d: %s over %s in %d shards', job.key.id(),
+                 op, kind, job.shards)
+    return job
+
+
+@ndb.transactional()
+def _checkpoint(shard_key, number, cursor, processed, changed, more):
+    """Record a finished slice and queue the next one, unless the slice
+    was already recorded by an earlier run of the same task."""
+    shard = shard_key.get()
+    if shard.slices != number:
+        return False
+    shard.slices += 1
+    shard.cursor = cursor.urlsafe() if cursor else None
+    shard.processed += processed
+    shard.changed += changed
+    shard.done = not more
+    shard.put()
+    if more:
+        _queueSlice(shard_key, shard.slices)
+    return True
+
+
+@ndb.transactional_tasklet
+def _applyToGroup(keys, func):
+    """Apply func to the entities of keys, all of one entity group, as
+    they are now; returns the number of entities written."""
+    entities = [entity for entity in (yield ndb.get_multi_async(keys))
+                if entity]
+    changed = func(entities) if entities else []
+    if changed:
+        yield ndb.put_multi_async(changed)
+    raise ndb.Return(len(changed))
+
+
+def runSlice(job_id, number, slice_number):
+    """Apply the job's operation to the next page of a shard."""
+    shard_key = ndb.Key(MapperJob, job_id, MapperShard, number)
+    job, shard = ndb.get_multi([shard_key.parent(), shard_key])
+    if not shard or shard.done or shard.slices != slice_number:
+        logging.info('Dropping stale slice %d of mapper job %d shard %d',
+                     slice_number, job_id, number)
+        return
+
+    began = time.time()
+    model = getattr(models, job.kind)
+    cursor = Cursor(urlsafe=shard.cursor) if shard.cursor else None
+    keys, next_cursor, more = _shardQuery(model, shard).fetch_page(
+        PAGE_SIZE, start_cursor=cursor, keys_only=True)
+    groups = collections.OrderedDict()
+    for key in keys:
+        groups.setdefault(key.root(), []).append(key)
+    func = OPERATIONS[job.operation][1]
+    futures = [_applyToGroup(group, func) for group in groups.values()]
+    changed = sum(future.get_result() for future in futures)
+
+    if _checkpoint(shard_key, slice_number, next_cursor, len(keys),
+                   changed, bool(more and next_cursor)):
+        flushOutbox()
+    elapsed = time.time() - began
+    logging.info('Mapper job %d shard %d slice %d: %d entities, %d '
+                 'changed in %.2fs (%.0f/s)', job_id, number, slice_number,
+                 len(keys), changed, elapsed,
+                 len(keys) / elapsed if elapsed else 0)
+
+
+def jobStatus(job_id):
+    """Return the progress of a job as a dict, or None if there is none."""
+    job = ndb.Key(MapperJob, job_id).get()
+    if not job:
+        return None
+    shards = MapperShard.query(ancestor=job.key).fetch()
+    processed = sum(shard.processed for shard in shards)
+    done = len([shard for shard in shards if shard.done])
+    last = max([shard.updated for shard in shards] or [job.started])
+    until = last if done == len(shards) else datetime.now()
+    elapsed = (until - job.started).total_seconds()
+    return {
+        'job': job_id,
+        'kind': job.kind,
+        'operation': job.operation,
+        'status': 'done' if done == len(shards) else 'running',
+        'started': job.started.isoformat(),
+        'shards': len(shards),
+        'shardsDone': done,
+        'processed': processed,
+        'changed': sum(shard.changed for shard in shards),
+        'elapsedSeconds': round(elapsed, 1),
+        'perSecond': round(processed / elapsed, 1) if elapsed else None,
+    }
+
+
+def runMigrations():
+    """Start the jobs of migrations not started yet and mark those whose
+    jobs all finished as done; returns {name: done}."""
+    result = {}
+    for name, jobs in MIGRATIONS:
+        migration = Migration.get_by_id(name) or Migration(id=name)
+        if not migration.done:
+            if not migration.jobs:
+                migration.jobs = [startJob(kind, op).key.id()
+                                  for kind, op in jobs]
+                migration.put()
+            elif all((jobStatus(job_id) or {}).get('status') == 'done'
+                     for job_id in migration.jobs):
+                migration.done = True
+                migration.put()
+                logging.info('Migration %s done', name)
+        result[name] = migration.done
+    return result
+
+
+def migrationDone(name):
+    """Return whether migration name has run to completion; a pending
+    migration is re-read at most every MIGRATION_RECHECK seconds."""
+    if name in _migrated:
+        return True
+    if time.time() - _migration_checked.get(name, 0) < MIGRATION_RECHECK:
+        return False
+    migration = Migration.get_by_id(name)
+    if migration and migration.done:
+        _migrated.add(name)
+        return True
+    _migration_checked[name] = time.time()
+    return False
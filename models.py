@@ -13,6 +13,8 @@ created/forked from conferences.py by wesc on 2014 may 24
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 import httplib
+from datetime import datetime
+from datetime import timedelta
 import endpoints
 from protorpc import messages
 from google.appengine.ext import ndb
@@ -21,6 +23,18 @@ class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
 
+class TooManyRequestsException(endpoints.ForbiddenException):
+    """TooManyRequestsException -- rate limit exceeded, with the seconds
+    to wait before retrying. Endpoints v1 only passes 400, 401, 403, 404,
+    409, 410, 412 and 413 through to clients, so the API answers 403
+    like Google's own rateLimitExceeded errors; the /fast handlers
+    answer 429 with a Retry-After header."""
+    fastStatus = 429
+
+    def __init__(self, message=None, retryAfter=None):
+        super(TooManyRequestsException, self).__init__(message)
+        self.retryAfter = retryAfter
+
 class Profile(ndb.Model):
     """Profile -- User profile object"""
     displayName = ndb.StringProperty()
@@ -28,6 +42,14 @@ class Profile(ndb.Model):
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     sessionKeysToAttend = ndb.StringProperty(repeated=True)
+    # notifications created up to here count as read
+    notificationsRead = ndb.DateTimeProperty(indexed=False)
+
+class WishlistEntry(ndb.Model):
+    """WishlistEntry -- session on a profile's wishlist; child of the
+    Profile, keyed by the session's websafe key"""
+    sessionKey      = ndb.KeyProperty(kind='Session')
+    added           = ndb.DateTimeProperty(auto_now_add=True)
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -62,6 +84,17 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    # set by the archival cron once endDate has passed; hot queries
+    # only look at archived == False
+    archived        = ndb.BooleanProperty(default=False)
+    # bumped by organizer edits only, and checked by patchConference; a
+    # registration does not make an organizer's pending edit conflict
+    version         = ndb.IntegerProperty(default=0, indexed=False)
+    revision        = ndb.IntegerProperty(default=0, indexed=False)
+
+    def _pre_put_hook(self):
+        # every write is a new revision; see fastjson.py
+        self.revision = (self.revision or 0) + 1
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -77,6 +110,7 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    version         = messages.IntegerField(13)
 
 
 class ConferenceForms(messages.Message):
@@ -111,6 +145,7 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    includeArchived = messages.BooleanField(2)
 
 # Session model
 class Session(ndb.Model):
@@ -122,6 +157,23 @@ class Session(ndb.Model):
     typeOfSession   = ndb.StringProperty()
     date            = ndb.DateProperty()
     startTime       = ndb.TimeProperty()
+    # derived from date, startTime & duration so time windows are one
+    # range query; kept up to date on every put
+    startDateTime   = ndb.DateTimeProperty()
+    endDateTime     = ndb.DateTimeProperty()
+    # copied from the conference by the archival cron
+    archived        = ndb.BooleanProperty(default=False)
+    version         = ndb.IntegerProperty(default=0, indexed=False)
+
+    def _pre_put_hook(self):
+        # every write is a new version; see fastjson.py
+        self.version = (self.version or 0) + 1
+        if self.date and self.startTime:
+            self.startDateTime = datetime.combine(self.date, self.startTime)
+            self.endDateTime = self.startDateTime + timedelta(
+                minutes=self.duration or 0)
+        else:
+            self.startDateTime = self.endDateTime = None
 
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
@@ -134,11 +186,34 @@ class SessionForm(messages.Message):
     startTime       = messages.StringField(7)
     websafeKey      = messages.StringField(8)
     websafeConferenceKey = messages.StringField(9)
+    startDateTime   = messages.StringField(10)
+    endDateTime     = messages.StringField(11)
 
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
 
+class AgendaDayForm(messages.Message):
+    """AgendaDayForm -- sessions of one conference day, by start time"""
+    date            = messages.StringField(1)
+    items           = messages.MessageField(SessionForm, 2, repeated=True)
+
+class AgendaForm(messages.Message):
+    """AgendaForm -- page of a conference agenda bucketed by day"""
+    days            = messages.MessageField(AgendaDayForm, 1, repeated=True)
+    nextPageToken   = messages.StringField(2)
+
+class AgendaItemForm(messages.Message):
+    """AgendaItemForm -- wishlisted session with its schedule conflicts"""
+    session         = messages.MessageField(SessionForm, 1)
+    conflicts       = messages.BooleanField(2)
+    conflictsWith   = messages.StringField(3, repeated=True)
+
+class MyAgendaForm(messages.Message):
+    """MyAgendaForm -- page of a user's wishlisted sessions by start time"""
+    items           = messages.MessageField(AgendaItemForm, 1, repeated=True)
+    nextPageToken   = messages.StringField(2)
+
 class SessionQueryForm(messages.Message):
     """SessionQueryForm -- Session query inbound form message"""
     field = messages.StringField(1)
@@ -148,3 +223,183 @@ class SessionQueryForm(messages.Message):
 class SessionQueryForms(messages.Message):
     """SessionQueryForms -- multiple Session query inbound form message"""
     filters = messages.MessageField(SessionQueryForm, 1, repeated=True)
+
+class OutboxTask(ndb.Model):
+    """OutboxTask -- task queued in the same transaction as its parent"""
+    queueName       = ndb.StringProperty(indexed=False)
+    url             = ndb.StringProperty(indexed=False)
+    method          = ndb.StringProperty(indexed=False)
+    params          = ndb.JsonProperty()
+    payload         = ndb.TextProperty()
+    tag             = ndb.StringProperty(indexed=False)  # pull queues
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class CatalogSnapshot(ndb.Model):
+    """CatalogSnapshot -- one generation of the public conference catalog"""
+    generation      = ndb.IntegerProperty()
+    etag            = ndb.StringProperty(indexed=False)
+    chunks          = ndb.IntegerProperty(indexed=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class CatalogChunk(ndb.Model):
+    """CatalogChunk -- compressed slice of a CatalogSnapshot; its child"""
+    data            = ndb.BlobProperty()
+
+class CatalogForm(messages.Message):
+    """CatalogForm -- public catalog snapshot, unless notModified"""
+    etag            = messages.StringField(1)
+    notModified     = messages.BooleanField(2)
+    data            = messages.StringField(3)
+
+class RecommendationModel(ndb.Model):
+    """RecommendationModel -- co-attendance and topic scores of the last
+    recommendation run (see cooccurrence.py), stored in chunks"""
+    # the whole model, as written before it was chunked
+    data            = ndb.BlobProperty(compressed=True)
+    chunks          = ndb.IntegerProperty(indexed=False)
+    size            = ndb.IntegerProperty(indexed=False)  # compressed
+    profiles        = ndb.IntegerProperty(indexed=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class RecommendationChunk(ndb.Model):
+    """RecommendationChunk -- zlib-compressed slice of the
+    RecommendationModel; its child, numbered from 1"""
+    _use_memcache   = False
+    data            = ndb.BlobProperty()
+
+class Recommendations(ndb.Model):
+    """Recommendations -- top conferences for a profile, keyed by its
+    user id"""
+    items           = ndb.JsonProperty()
+    updated         = ndb.DateTimeProperty(auto_now=True)
+
+class RecommendationForm(messages.Message):
+    """RecommendationForm -- recommended conference outbound form message"""
+    websafeKey      = messages.StringField(1)
+    name            = messages.StringField(2)
+    city            = messages.StringField(3)
+    startDate       = messages.StringField(4)
+    topics          = messages.StringField(5, repeated=True)
+    score           = messages.FloatField(6)
+
+class RecommendationForms(messages.Message):
+    """RecommendationForms -- recommended conferences, best first"""
+    items           = messages.MessageField(RecommendationForm, 1, repeated=True)
+
+class MapperJob(ndb.Model):
+    """MapperJob -- batch job applying an operation to every entity of a
+    kind (see mapper.py)"""
+    kind            = ndb.StringProperty(indexed=False)
+    operation       = ndb.StringProperty(indexed=False)
+    shards          = ndb.IntegerProperty(indexed=False)
+    started         = ndb.DateTimeProperty(auto_now_add=True)
+
+class MapperShard(ndb.Model):
+    """MapperShard -- key range of a MapperJob and its checkpoint; child
+    of the job"""
+    lo              = ndb.KeyProperty(indexed=False)   # inclusive
+    hi              = ndb.KeyProperty(indexed=False)   # exclusive
+    cursor          = ndb.StringProperty(indexed=False)
+    slices          = ndb.IntegerProperty(default=0, indexed=False)
+    processed       = ndb.IntegerProperty(default=0, indexed=False)
+    changed         = ndb.IntegerProperty(default=0, indexed=False)
+    done            = ndb.BooleanProperty(default=False, indexed=False)
+    updated         = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+class Migration(ndb.Model):
+    """Migration -- deploy migration run as mapper jobs (see
+    mapper.MIGRATIONS); keyed by name"""
+    jobs            = ndb.IntegerProperty(repeated=True, indexed=False)
+    done            = ndb.BooleanProperty(default=False, indexed=False)
+    started         = ndb.DateTimeProperty(auto_now_add=True)
+
+class SeatAudit(ndb.Model):
+    """SeatAudit -- run of the seat reconciliation (see reconcile.py)"""
+    repair          = ndb.BooleanProperty(indexed=False)
+    # count, check, repair, done
+    phase           = ndb.StringProperty(indexed=False)
+    steps           = ndb.IntegerProperty(default=0, indexed=False)
+    cursor          = ndb.StringProperty(indexed=False)
+    registrations   = ndb.IntegerProperty(default=0, indexed=False)
+    checked         = ndb.IntegerProperty(default=0, indexed=False)
+    found           = ndb.IntegerProperty(default=0, indexed=False)
+    repaired        = ndb.IntegerProperty(default=0, indexed=False)
+    started         = ndb.DateTimeProperty(auto_now_add=True)
+    updated         = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+class SeatCount(ndb.Model):
+    """SeatCount -- registrations for one conference counted by a
+    SeatAudit; its child, keyed by the conference's websafe key"""
+    count           = ndb.IntegerProperty(default=0, indexed=False)
+
+class SeatDiscrepancy(ndb.Model):
+    """SeatDiscrepancy -- conference whose seats taken differ from its
+    registrations; child of the SeatAudit, keyed by websafe key"""
+    name            = ndb.StringProperty(indexed=False)
+    maxAttendees    = ndb.IntegerProperty(indexed=False)
+    seatsAvailable  = ndb.IntegerProperty(indexed=False)
+    taken           = ndb.IntegerProperty(indexed=False)
+    registered      = ndb.IntegerProperty(indexed=False)
+    revision        = ndb.IntegerProperty(indexed=False)
+    checked         = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+    repaired        = ndb.BooleanProperty(default=False, indexed=False)
+
+class Tombstone(ndb.Model):
+    """Tombstone -- deleted conference or session whose references are
+    being purged (see purge.py); child of the deleted entity's key"""
+    phase           = ndb.StringProperty(indexed=False)
+    # sent to the users referring to it (see notifications.py), if any
+    notice          = ndb.JsonProperty()
+    steps           = ndb.IntegerProperty(default=0, indexed=False)
+    cursor          = ndb.StringProperty(indexed=False)
+    removed         = ndb.IntegerProperty(default=0, indexed=False)
+    deleted         = ndb.DateTimeProperty(auto_now_add=True)
+
+class Notification(ndb.Model):
+    """Notification -- inbox entry of a user; child of the Profile, keyed
+    by the id of the notice"""
+    _use_memcache   = False
+    kind            = ndb.StringProperty(indexed=False)
+    websafeKey      = ndb.StringProperty(indexed=False)
+    message         = ndb.StringProperty(indexed=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class NotificationForm(messages.Message):
+    """NotificationForm -- Notification outbound form message"""
+    kind            = messages.StringField(1)
+    websafeKey      = messages.StringField(2)
+    message         = messages.StringField(3)
+    created         = messages.StringField(4)
+    unread          = messages.BooleanField(5)
+
+class NotificationForms(messages.Message):
+    """NotificationForms -- page of a user's notifications, newest first"""
+    items           = messages.MessageField(NotificationForm, 1, repeated=True)
+    nextPageToken   = messages.StringField(2)
+    unread          = messages.IntegerField(3)
+
+class AttendeeExport(ndb.Model):
+    """AttendeeExport -- CSV roster of a conference's attendees, built in
+    the background (see exports.py); child of the organizer's Profile"""
+    # indexed so the purge of a deleted conference finds its exports
+    websafeConferenceKey = ndb.StringProperty()
+    token           = ndb.StringProperty(indexed=False)  # for the download
+    steps           = ndb.IntegerProperty(default=0, indexed=False)
+    cursor          = ndb.StringProperty(indexed=False)
+    rows            = ndb.IntegerProperty(default=0, indexed=False)
+    done            = ndb.BooleanProperty(default=False, indexed=False)
+    started         = ndb.DateTimeProperty(auto_now_add=True)  # for expiry
+    finished        = ndb.DateTimeProperty(indexed=False)
+
+class ExportChunk(ndb.Model):
+    """ExportChunk -- compressed CSV rows of one step of an
+    AttendeeExport; its child, numbered from 1"""
+    data            = ndb.BlobProperty(compressed=True)
+
+class ExportForm(messages.Message):
+    """ExportForm -- status of an attendee export"""
+    websafeKey      = messages.StringField(1)
+    done            = messages.BooleanField(2)
+    rows            = messages.IntegerField(3)
+    rowsPerSecond   = messages.FloatField(4)
+    downloadUrl     = messages.StringField(5)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+"""notifications.py
+
+Change notifications for attendees and wishlisters.
+
+A change is described by a notice, {"id", "kind", "websafeKey",
+"message"}, and no request making a change touches its recipients:
+
+- notifyAttendees() queues, through the outbox of the change's
+  transaction, a fan-out task chain walking with keys-only queries,
+  FANOUT_PAGE_SIZE per task, first the registered profiles, then the
+  wishlist entries of the conference's sessions, leaving out the
+  profiles already reached as attendees;
+- every fan-out page is handed to notifyUsers(), which queues delivery
+  tasks of DELIVERY_BATCH_SIZE recipients; the purge of a deleted
+  conference or session calls it directly for the profiles it walks;
+- a delivery writes a Notification per recipient, a child of the Profile
+  keyed by the notice id so that a retried delivery writes nothing twice,
+  and bumps the recipients' unread counters in memcache.
+
+Counters are only bumped, never created; a missing counter is recounted
+from the inbox on the next read.
+
+"""
+
+import json
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Notification
+from models import Profile
+from models import WishlistEntry
+from outbox import addOutboxTask
+
+FANOUT_PAGE_SIZE = 1000
+DELIVERY_BATCH_SIZE = 300
+MEMCACHE_UNREAD_KEY = 'UNREAD:%s'
+UNREAD_TTL = 3600
+MAX_UNREAD = 100            # unread notifications counted up to this
+
+NOTIFIED_FIELDS = ('startDate', 'endDate', 'city')
+
+
+def noticeOf(entity, kind, message):
+    """Return the notice of a change to a conference or session; unique
+    per kind and version of the entity."""
+    return {'id': '%s-%d-v%d' % (kind, entity.key.id(), entity.version),
+            'kind': kind, 'websafeKey': entity.key.urlsafe(),
+            'message': message}
+
+
+def notifyAttendees(conf, changed):
+    """Notify the attendees of conf and the wishlisters of its sessions
+    if its dates or city changed; call inside the transaction writing
+    it."""
+    changed = [name for name in NOTIFIED_FIELDS if name in changed]
+    if not changed:
+        return
+    notice = noticeOf(conf, 'conferenceChanged', '%s changed: %s' % (
+        conf.name, ', '.join('%s is now %s' % (name, getattr(conf, name))
+                             for name in changed)))
+    addOutboxTask(conf.key, 'notify-v%d' % conf.version, url='/tasks/notify',
+                  params={'notice': json.dumps(notice),
+                          'wsck': conf.key.urlsafe()})
+
+
+def _addTasks(tasks):
+    """Add named tasks, ignoring those a previous attempt added."""
+    queue = taskqueue.Queue()
+    for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+        try:
+            queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            # the rest of the batch was added
+            pass
+
+
+def notifyUsers(notice, user_ids, page):
+    """Queue the delivery of notice to user_ids in batches. page names
+    this set of recipients among all of the notice's, so that a retried
+    call queues nothing twice."""
+    payload = lambda users: json.dumps({'notice': notice, 'users': users})
+    _addTasks([taskqueue.Task(
+        name='%s-%s-%d' % (notice['id'], page, i // DELIVERY_BATCH_SIZE),
+        url='/tasks/notify/deliver',
+        payload=payload(user_ids[i:i + DELIVERY_BATCH_SIZE]))
+        for i in range(0, len(user_ids), DELIVERY_BATCH_SIZE)])
+
+
+def _attendeesPage(wsck, cursor):
+    """Return (user ids, cursor, more) of one page of wsck's attendees."""
+    p_keys, next_cursor, more = Profile.query(
+        Profile.conferenceKeysToAttend == wsck).fetch_page(
+            FANOUT_PAGE_SIZE, keys_only=True, start_cursor=cursor)
+    return [p_key.id() for p_key in p_keys], next_cursor, more
+
+
+def _wishlistersPage(wsck, cursor):
+    """Return (user ids, cursor, more) of one page of the wishlist
+    entries of wsck's sessions, without the users registered for wsck."""
+    # sessions hang off the conference id (see _createSessionObject), and
+    # keys sort by path, so the keys of its sessions lie between its own
+    # and that of the next conference id; FilterNode, as sessionKey would
+    # reject Conference keys as values
+    c_id = ndb.Key(urlsafe=wsck).id()
+    e_keys, next_cursor, more = WishlistEntry.query(
+        ndb.FilterNode('sessionKey', '>', ndb.Key(Conference, c_id)),
+        ndb.FilterNode('sessionKey', '<', ndb.Key(Conference, c_id + 1))
+    ).fetch_page(FANOUT_PAGE_SIZE, keys_only=True, start_cursor=cursor)
+    # a wishlister of several sessions is listed once per page; one whose
+    # entries span pages gets the notice queued again, which deliver()
+    # skips once the first delivery has written it
+    p_keys = sorted(set(e_key.parent() for e_key in e_keys))
+    user_ids = [prof.key.id() for prof in ndb.get_multi(p_keys)
+                if prof and wsck not in prof.conferenceKeysToAttend]
+    return user_ids, next_cursor, more
+
+
+FANOUT_PHASES = [('attendees', _attendeesPage),
+                 ('wishlists', _wishlistersPage)]
+
+
+def fanOut(notice, wsck, cursor=None, page=0, phase='attendees'):
+    """Queue deliveries to one page of the recipients of notice in phase
+    and chain the next page, or the next phase."""
+    phases = [name for name, _ in FANOUT_PHASES]
+    user_ids, next_cursor, more = dict(FANOUT_PHASES)[phase](wsck, cursor)
+    notifyUsers(notice, user_ids, page)
+    if not (more and next_cursor):
+        following = phases.index(phase) + 1
+        if following == len(phases):
+            return
+        phase, next_cursor = phases[following], None
+    params = {'notice': json.dumps(notice), 'wsck': wsck,
+              'page': str(page + 1), 'phase': phase}
+    if next_cursor:
+        params['cursor'] = next_cursor.urlsafe()
+    _addTasks([taskqueue.Task(
+        name='%s-fanout-%d' % (notice['id'], page + 1),
+        url='/tasks/notify', params=params)])
+
+
+def deliver(notice, user_ids):
+    """Write notice to the inboxes of user_ids that do not have it yet."""
+    keys = [ndb.Key(Profile, user_id, Notification, notice['id'])
+            for user_id in user_ids]
+    new = [key for key, found in zip(keys, ndb.get_multi(keys))
+           if not found]
+    ndb.put_multi([Notification(key=key, kind=notice['kind'],
+                                websafeKey=notice['websafeKey'],
+                                message=notice['message'])
+                   for key in new])
+    memcache.offset_multi(dict((MEMCACHE_UNREAD_KEY % key.parent().id(), 1)
+                               for key in new))
+    return len(new)
+
+
+def inboxQuery(prof):
+    """Return the query for a profile's notifications, newest first."""
+    return Notification.query(ancestor=prof.key).order(-Notification.created)
+
+
+def unreadCount(prof):
+    """Return the number of notifications of prof not marked read, up to
+    MAX_UNREAD."""
+    key = MEMCACHE_UNREAD_KEY % prof.key.id()
+    count = memcache.get(key)
+    if count is None:
+        q = inboxQuery(prof)
+        if prof.notificationsRead:
+            q = q.filter(Notification.created > prof.notificationsRead)
+        count = q.count(MAX_UNREAD)
+        memcache.add(key, count, time=UNREAD_TTL)
+    return min(count, MAX_UNREAD)
+
+
+@ndb.transactional()
+def _setRead(p_key, until):
+    prof = p_key.get()
+    prof.notificationsRead = until
+    prof.put()
+
+
+def markRead(prof, until):
+    """Mark the notifications of prof created up to until as read."""
+    _setRead(prof.key, until)
+    memcache.set(MEMCACHE_UNREAD_KEY % prof.key.id(), 0, time=UNREAD_TTL)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""outbox.py
+
+Transactional task outbox for the write path.
+
+addOutboxTask() stores the task as a child of the entity being written,
+inside the same transaction, so a committed write always has its task.
+Once the transaction commits the task is queued for this request and
+flushOutbox() adds everything queued with add_async in batches, under a
+task name derived from the parent key so retried flushes never run a
+task twice. Rows whose flush failed are picked up by the
+/crons/flush_outbox sweeper.
+
+"""
+
+import functools
+import logging
+import threading
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import OutboxTask
+
+MAX_TASKS_PER_ADD = taskqueue.MAX_TASKS_PER_ADD
+SWEEP_AGE = timedelta(minutes=5)
+SWEEP_BATCH_SIZE = 500
+
+_local = threading.local()
+
+
+def _pending():
+    if not hasattr(_local, 'tasks'):
+        _local.tasks = []
+    return _local.tasks
+
+
+def outboxTask(parent, prefix, url=None, params=None, payload=None,
+               queue_name='default', method='POST', tag=None):
+    """Return an unsaved outbox task, for writing many in one batch.
+
+    The task is named '<prefix>-<urlsafe parent key>', which makes it
+    unique per entity and deduplicates repeated flushes.
+    """
+    return OutboxTask(parent=parent, id=prefix, queueName=queue_name,
+                      url=url, params=params, payload=payload,
+                      method=method, tag=tag)
+
+
+def addOutboxTask(parent, prefix, url=None, params=None, payload=None,
+                  queue_name='default', method='POST', tag=None):
+    """Store a task next to parent; call inside the transaction writing it.
+    See outboxTask() for its name."""
+    entry = outboxTask(parent, prefix, url, params, payload, queue_name,
+                       method, tag)
+    entry.put()
+    ndb.get_context().call_on_commit(lambda: _pending().append(entry))
+    return entry
+
+
+def _toTask(entry):
+    return taskqueue.Task(
+        name='%s-%s' % (entry.key.id(), entry.key.parent().urlsafe()),
+        url=entry.url, params=entry.params, payload=entry.payload,
+        method=entry.method, tag=entry.tag)
+
+
+def flushOutbox(entries=None):
+    """Add outbox tasks to their queues and clear the flushed rows.
+
+    Defaults to the tasks committed during this request. Returns the
+    number of tasks that are now safely in their queues.
+    """
+    if entries is None:
+        entries = _pending()[:]
+        del _pending()[:]
+    by_queue = {}
+    for entry in entries:
+        by_queue.setdefault(entry.queueName, []).append(entry)
+
+    # start every batch before waiting on any of them
+    rpcs = []
+    for queue_name, queued in by_queue.items():
+        queue = taskqueue.Queue(queue_name)
+        for i in range(0, len(queued), MAX_TASKS_PER_ADD):
+            batch = queued[i:i + MAX_TASKS_PER_ADD]
+            rpcs.append((queue.add_async([_toTask(e) for e in batch]),
+                         batch))
+
+    flushed = []
+    for rpc, batch in rpcs:
+        try:
+            rpc.get_result()
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            # the rest of the batch was added; named duplicates are fine
+            pass
+        except taskqueue.Error:
+            logging.warning('Outbox flush failed for %d tasks, leaving '
+                            'them for the sweeper', len(batch),
+                            exc_info=True)
+            continue
+        flushed.extend(batch)
+
+    if flushed:
+        ndb.delete_multi([entry.key for entry in flushed])
+    return len(flushed)
+
+
+def sweepOutbox():
+    """Flush outbox rows left behind by failed or interrupted requests."""
+    cutoff = datetime.now() - SWEEP_AGE
+    entries = OutboxTask.query(OutboxTask.created < cutoff).fetch(
+        SWEEP_BATCH_SIZE)
+    return flushOutbox(entries)
+
+
+def withOutbox(func):
+    """Decorate an endpoint method so its outbox is flushed as it returns."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            flushOutbox()
+    return wrapper
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""purge.py
+
+Deletion of conferences and sessions.
+
+deleteWithTombstone() deletes the entity right away, in one transaction
+with its Tombstone and the outbox task that starts purging whatever
+refers to it; from then on gets of it return None, which the list
+endpoints skip. The purge is a chain of tasks, one batch each,
+checkpointed on the tombstone like the mapper jobs:
+
+- a conference deletes its attendee exports, tombstones and deletes its
+  sessions, a keys-only batch at a time (each is then purged like any
+  deleted session), then strips its key from the profiles registered
+  for it;
+- a session deletes the wishlist entries of it, then strips its key from
+  legacy Profile.sessionKeysToAttend lists.
+
+The profiles walked are sent the tombstone's notice, if it has one.
+
+"""
+
+import logging
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from caches import expireAgendas
+from exports import deleteExports
+from notifications import notifyUsers
+from models import AttendeeExport
+from models import Conference
+from models import Profile
+from models import Session
+from models import Tombstone
+from models import WishlistEntry
+from outbox import addOutboxTask
+from outbox import flushOutbox
+from outbox import outboxTask
+
+PURGE_BATCH_SIZE = 100
+TOMBSTONE_ID = 1
+
+PHASES = {
+    'Conference': ['exports', 'sessions', 'attendees'],
+    'Session': ['wishlists', 'legacyWishlists'],
+}
+
+
+def _queueStep(t_key, number, task=addOutboxTask):
+    """Queue step number of a purge inside the transaction writing its
+    tombstone; with task=outboxTask, return the unsaved task instead."""
+    return task(t_key, 'step-%d' % number, url='/tasks/purge',
+                params={'tombstone': t_key.urlsafe(), 'step': str(number)})
+
+
+def _tombstone(key, notice=None):
+    return Tombstone(parent=key, id=TOMBSTONE_ID,
+                     phase=PHASES[key.kind()][0], notice=notice)
+
+
+@ndb.transactional()
+def deleteWithTombstone(key, notice=None):
+    """Delete the conference or session of key and start purging the
+    references to it, sending notice to the users referring to it.
+    Returns False if it did not exist."""
+    if not key.get():
+        return False
+    key.delete()
+    tomb = _tombstone(key, notice)
+    tomb.put()
+    _queueStep(tomb.key, 0)
+    return True
+
+
+@ndb.transactional()
+def _stripReference(p_key, name, websafe_key):
+    """Remove websafe_key from the string list name of a profile."""
+    prof = p_key.get()
+    keys = getattr(prof, name) if prof else []
+    if websafe_key in keys:
+        setattr(prof, name, [key for key in keys if key != websafe_key])
+        prof.put()
+
+
+def _notify(tomb, user_ids):
+    if tomb.notice and user_ids:
+        notifyUsers(tomb.notice, list(user_ids), tomb.steps)
+
+
+def _stripFromProfiles(tomb, prop, cursor):
+    """Notify one batch of the profiles listing the tombstoned key in prop
+    and strip it from them; returns (more, cursor, profiles done)."""
+    websafe_key = tomb.key.parent().urlsafe()
+    p_keys, next_cursor, more = Profile.query(
+        prop == websafe_key).fetch_page(PURGE_BATCH_SIZE, keys_only=True,
+                                        start_cursor=cursor)
+    # before stripping, as a retried step may no longer find them
+    _notify(tomb, [p_key.id() for p_key in p_keys])
+    for p_key in p_keys:
+        _stripReference(p_key, prop._name, websafe_key)
+    return more and next_cursor, next_cursor, len(p_keys)
+
+
+def _purgeExports(tomb, cursor):
+    """Delete one batch of the attendee exports of a deleted conference."""
+    e_keys, next_cursor, more = AttendeeExport.query(
+        AttendeeExport.websafeConferenceKey == tomb.key.parent().urlsafe()
+    ).fetch_page(PURGE_BATCH_SIZE, keys_only=True, start_cursor=cursor)
+    deleteExports(e_keys)
+    return more and next_cursor, next_cursor, len(e_keys)
+
+
+def _purgeSessions(tomb, cursor):
+    """Tombstone and delete one batch of a deleted conference's sessions."""
+    # sessions hang off the conference id (see _createSessionObject)
+    c_key = ndb.Key(Conference, tomb.key.parent().id())
+    s_keys = Session.query(ancestor=c_key).fetch(PURGE_BATCH_SIZE,
+                                                 keys_only=True)
+    tombs = [_tombstone(s_key) for s_key in s_keys]
+    tasks = [_queueStep(t.key, 0, outboxTask) for t in tombs]
+    # the tombstones are written before the sessions go, so an
+    # interrupted batch is simply found and written again
+    ndb.put_multi(tombs + tasks)
+    ndb.delete_multi(s_keys)
+    flushOutbox(tasks)
+    # the ancestor query is strongly consistent; no cursor needed
+    return len(s_keys) == PURGE_BATCH_SIZE, None, len(s_keys)
+
+
+def _purgeAttendees(tomb, cursor):
+    return _stripFromProfiles(tomb, Profile.conferenceKeysToAttend, cursor)
+
+
+def _purgeWishlists(tomb, cursor):
+    """Delete one batch of the wishlist entries of a deleted session."""
+    e_keys, next_cursor, more = WishlistEntry.query(
+        WishlistEntry.sessionKey == tomb.key.parent()).fetch_page(
+            PURGE_BATCH_SIZE, keys_only=True, start_cursor=cursor)
+    user_ids = set(e_key.parent().id() for e_key in e_keys)
+    _notify(tomb, user_ids)
+    ndb.delete_multi(e_keys)
+    expireAgendas(user_ids)
+    return more and next_cursor, next_cursor, len(e_keys)
+
+
+def _purgeLegacyWishlists(tomb, cursor):
+    return _stripFromProfiles(tomb, Profile.sessionKeysToAttend, cursor)
+
+
+STEPS = {
+    'exports': _purgeExports,
+    'sessions': _purgeSessions,
+    'attendees': _purgeAttendees,
+    'wishlists': _purgeWishlists,
+    'legacyWishlists': _purgeLegacyWishlists,
+}
+
+
+@ndb.transactional()
+def _checkpoint(t_key, number, more, cursor, removed):
+    """Record a finished step and queue the next one, unless the step
+    was already recorded by an earlier run of the same task."""
+    tomb = t_key.get()
+    if tomb.steps != number:
+        return None
+    tomb.steps += 1
+    tomb.removed += removed
+    if more:
+        tomb.cursor = cursor.urlsafe() if cursor else None
+    else:
+        phases = PHASES[t_key.parent().kind()]
+        following = phases.index(tomb.phase) + 1
+        tomb.phase = (phases[following] if following < len(phases)
+                      else 'done')
+        tomb.cursor = None
+    tomb.put()
+    if tomb.phase != 'done':
+        _queueStep(t_key, tomb.steps)
+    return tomb
+
+
+def runStep(t_key, number):
+    """Run the next step of purging a deleted conference or session."""
+    tomb = t_key.get()
+    if not tomb or tomb.phase == 'done' or tomb.steps != number:
+        logging.info('Dropping stale purge step %d of %s', number,
+                     t_key.parent())
+        return
+
+    cursor = Cursor(urlsafe=tomb.cursor) if tomb.cursor else None
+    more, next_cursor, removed = STEPS[tomb.phase](tomb, cursor)
+    tomb = _checkpoint(t_key, number, bool(more), next_cursor, removed)
+    if tomb:
+        flushOutbox()
+        if tomb.phase == 'done':
+            logging.info('Purged %s: %d references in %d steps',
+                         t_key.parent(), tomb.removed, tomb.steps)
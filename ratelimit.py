@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""ratelimit.py
+
+Per-user, per-endpoint rate limits.
+
+Every endpoint listed in RATE_LIMITS has a fixed-window counter per
+caller: the user id for signed-in calls, the client address otherwise.
+Each window lasts capacity / perSecond seconds and lets capacity calls
+through, so a call costs a single atomic memcache incr. This averages
+perSecond calls a second, but unlike a token bucket it does not smooth
+bursts: a caller can spend one window's capacity at its end and the
+next window's at its start, so up to 2 * capacity calls get through in
+a short span across a window boundary. The limits below are set with
+that in mind. A caller found over the limit is also remembered in the
+instance until its window ends, so a retry loop is turned away without
+memcache calls.
+
+Rejections raise TooManyRequestsException, which Endpoints sends as a
+403 (it drops 429); its message ends with "retryAfter=<seconds>" for
+clients to parse. The /fast handlers answer 429 with Retry-After.
+
+Calls and rejections are counted per endpoint in memcache for
+monitoring (see rateStats and /tasks/rate_limits). Rejections are
+counted in the instance and added to memcache with the next allowed
+call's incr, so they cost no extra RPC.
+
+"""
+
+import functools
+import math
+import threading
+import time
+
+import endpoints
+from google.appengine.api import memcache
+
+from caches import localGet
+from caches import localSet
+from models import TooManyRequestsException
+from utils import getUserId
+
+MEMCACHE_WINDOW_KEY = 'RATE:%s:%s:%d'     # endpoint, caller, window
+MEMCACHE_STATS_KEY = 'RATESTATS:%s:%s'    # endpoint, calls or limited
+
+# endpoint name -> (capacity, perSecond); bursts may reach 2 * capacity
+RATE_LIMITS = {
+    'registerForConference': (10, 0.2),
+    'createSession': (20, 0.2),
+    'addSessionToWishlist': (20, 0.5),
+    'saveProfile': (5, 0.1),
+    'queryConferences': (30, 1.0),
+    # scans every session
+    'nonWorkshopsBefore7': (5, 0.05),
+}
+
+_limited = {}               # endpoint -> rejections not yet in memcache
+_limited_lock = threading.Lock()
+
+
+def _window(name, now):
+    """Return (window number, seconds left in it) of name's counters."""
+    capacity, per_second = RATE_LIMITS[name]
+    length = capacity / per_second
+    number = int(now // length)
+    return number, (number + 1) * length - now
+
+
+def _addLimited(counts):
+    with _limited_lock:
+        for name, count in counts.items():
+            _limited[name] = _limited.get(name, 0) + count
+
+
+def _takeLimited():
+    with _limited_lock:
+        counts = dict(_limited)
+        _limited.clear()
+    return counts
+
+
+def _reject(name, retry_after):
+    _addLimited({name: 1})
+    retry_after = int(math.ceil(retry_after))
+    raise TooManyRequestsException(
+        'Rate limit of %s exceeded; retryAfter=%d' % (name, retry_after),
+        retry_after)
+
+
+def checkRate(name, caller):
+    """Count a call by caller to endpoint name, raising
+    TooManyRequestsException if it is over the limit of its window.
+    Endpoints without a limit are not checked."""
+    if name not in RATE_LIMITS:
+        return
+    number, left = _window(name, time.time())
+    key = MEMCACHE_WINDOW_KEY % (name, caller, number)
+    if localGet(key):
+        _reject(name, left)
+
+    deltas = {key: 1, MEMCACHE_STATS_KEY % (name, 'calls'): 1}
+    flushed = _takeLimited()
+    for limited_name, count in flushed.items():
+        deltas[MEMCACHE_STATS_KEY % (limited_name, 'limited')] = count
+    # incr cannot set an expiry; counters of past windows are never read
+    # again and are the first to go when memcache evicts
+    taken = memcache.offset_multi(deltas, initial_value=0).get(key)
+    if taken is None:
+        # memcache is down; give the rejections back and let the call in
+        _addLimited(flushed)
+        return
+    if taken > RATE_LIMITS[name][0]:
+        localSet(key, True, ttl=left)
+        _reject(name, left)
+
+
+def callerOf(service):
+    """Return the rate-limited identity of the caller of an endpoint."""
+    user = endpoints.get_current_user()
+    if user:
+        return getUserId(user)
+    return 'ip:%s' % service.request_state.remote_address
+
+
+def rateLimited(func):
+    """Decorate an endpoint method so each call is counted against the
+    caller's limit for the method's name."""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        checkRate(func.__name__, callerOf(self))
+        return func(self, *args, **kwargs)
+    return wrapper
+
+
+def rateStats():
+    """Return {endpoint: {capacity, perSecond, calls, limited}}, counted
+    since memcache last dropped the counters."""
+    keys = [MEMCACHE_STATS_KEY % (name, counter)
+            for name in RATE_LIMITS for counter in ('calls', 'limited')]
+    counts = memcache.get_multi(keys)
+    stats = {}
+    for name, (capacity, per_second) in RATE_LIMITS.items():
+        stats[name] = {
+            'capacity': capacity,
+            'perSecond': per_second,
+            'calls': counts.get(MEMCACHE_STATS_KEY % (name, 'calls'), 0),
+            'limited': counts.get(MEMCACHE_STATS_KEY % (name, 'limited'), 0),
+        }
+    return stats
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+"""reads.py
+
+Per-endpoint datastore read policies.
+
+Gets are strongly consistent unless the endpoint opts out in
+READ_POLICIES:
+
+- EVENTUAL reads skip waiting for writes to the entity group to be
+  applied, which is faster and cheaper under write load but may return
+  data a few seconds old;
+- a maximum staleness in seconds additionally serves entities from
+  memcache for up to that long, refilling it with eventual reads.
+
+Endpoints whose reads feed a cache that a write expires stay STRONG, or
+the refill could bring the old value back for the life of the cache.
+
+benchmark() measures the policies on the live datastore against scratch
+entities written like registrations (see /tasks/bench_reads).
+
+"""
+
+import random
+import threading
+import time
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+STRONG = 'strong'
+EVENTUAL = 'eventual'
+
+MEMCACHE_READ_KEY = 'READ:%s'
+
+# read name -> (consistency, maximum staleness in seconds or None)
+READ_POLICIES = {
+    # refills the conference cache expired by every write to it
+    'getConference': (STRONG, None),
+    'getConferencesToAttend': (EVENTUAL, None),
+    'getSessionsInWishlist': (EVENTUAL, None),
+    # display names of organizers; rarely changed, read on every list
+    'organizerNames': (EVENTUAL, 300),
+}
+
+
+def getMultiWithPolicy(keys, policy):
+    """Return the entities of keys (None if missing) read with policy, a
+    (consistency, maximum staleness) pair."""
+    consistency, staleness = policy
+    if consistency != EVENTUAL:
+        return ndb.get_multi(keys)
+    if not staleness:
+        return ndb.get_multi(keys, read_policy=ndb.EVENTUAL_CONSISTENCY)
+
+    cache_keys = [MEMCACHE_READ_KEY % key.urlsafe() for key in keys]
+    cached = memcache.get_multi(cache_keys)
+    missing = [key for key, cache_key in zip(keys, cache_keys)
+               if cache_key not in cached]
+    if missing:
+        found = ndb.get_multi(missing, read_policy=ndb.EVENTUAL_CONSISTENCY)
+        fresh = dict((MEMCACHE_READ_KEY % key.urlsafe(), entity)
+                     for key, entity in zip(missing, found) if entity)
+        memcache.set_multi(fresh, time=staleness)
+        cached.update(fresh)
+    return [cached.get(cache_key) for cache_key in cache_keys]
+
+
+def getMulti(keys, name):
+    """Return the entities of keys read with the policy of name."""
+    return getMultiWithPolicy(keys, READ_POLICIES.get(name, (STRONG, None)))
+
+
+def get(key, name):
+    """Return the entity of key read with the policy of name."""
+    return getMulti([key], name)[0]
+
+
+class ReadBench(ndb.Model):
+    """Scratch entity written and read by benchmark()."""
+    # measure the datastore, not ndb's caches
+    _use_cache = False
+    _use_memcache = False
+    counter = ndb.IntegerProperty(default=0, indexed=False)
+
+
+def _percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def benchmark(seconds=10, writers=8, readers=8, entities=20, batch=10):
+    """Time get_multi of batch scratch entities with each policy while
+    writers run cross-group transactions over pairs of them, like
+    registrations do over a profile and a conference.
+
+    Returns {policy: {reads, p50, p95, p99 (ms), writes}}.
+    """
+    keys = [ndb.Key(ReadBench, 'bench-%d' % i) for i in range(entities)]
+    ndb.put_multi([ReadBench(key=key) for key in keys])
+
+    @ndb.transactional(xg=True)
+    def register(pair):
+        touched = ndb.get_multi(pair)
+        for entity in touched:
+            entity.counter += 1
+        ndb.put_multi(touched)
+
+    policies = [('strong', (STRONG, None)), ('eventual', (EVENTUAL, None)),
+                ('bounded', (EVENTUAL, 5))]
+    results = {}
+    try:
+        for name, policy in policies:
+            latencies, writes = [], [0]
+            until = time.time() + seconds
+
+            def write():
+                while time.time() < until:
+                    try:
+                        register(random.sample(keys, 2))
+                        writes[0] += 1
+                    except datastore_errors.TransactionFailedError:
+                        pass    # contention; the load is what matters
+
+            def read():
+                while time.time() < until:
+                    began = time.time()
+                    getMultiWithPolicy(random.sample(keys, batch), policy)
+                    latencies.append((time.time() - began) * 1000)
+
+            threads = ([threading.Thread(target=write)
+                        for _ in range(writers)] +
+                       [threading.Thread(target=read)
+                        for _ in range(readers)])
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            latencies.sort()
+            if not latencies:
+                continue
+            results[name] = {
+                'reads': len(latencies),
+                'p50': round(_percentile(latencies, 0.5), 1),
+                'p95': round(_percentile(latencies, 0.95), 1),
+                'p99': round(_percentile(latencies, 0.99), 1),
+                'writes': writes[0],
+            }
+    finally:
+        ndb.delete_multi(keys)
+        memcache.delete_multi([MEMCACHE_READ_KEY % key.urlsafe()
+                               for key in keys])
+    return results
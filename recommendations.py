@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""recommendations.py
+
+Precomputed conference recommendations per profile.
+
+A daily cron rebuilds the cooccurrence.py model from the registrations
+of every profile and then scores all profiles in chained tasks, storing
+the top conferences of each in a Recommendations entity keyed by its user
+id. The model is stored zlib-compressed in RecommendationChunk entities
+below the entity size limit, written with their RecommendationModel in
+one transaction. Serving them is a single get, which ndb answers from memcache. A
+registration re-scores just that profile against the current model once
+it commits; its effect on other profiles waits for the next rebuild.
+
+"""
+
+import logging
+import zlib
+from datetime import date
+
+from google.appengine.ext import ndb
+
+from caches import localGet
+from caches import localSet
+from cooccurrence import buildModel
+from cooccurrence import dumpModel
+from cooccurrence import loadModel
+from cooccurrence import recommend
+from models import Conference
+from models import Profile
+from models import RecommendationChunk
+from models import RecommendationModel
+from models import Recommendations
+from outbox import addOutboxTask
+
+MODEL_ID = 'current'
+MODEL_LOCAL_KEY = 'RECOMMENDATION_MODEL'
+MODEL_LOCAL_TTL = 600
+PROFILE_BATCH_SIZE = 1000
+SCORE_PAGE_SIZE = 500
+CHUNK_SIZE = 900 * 1024         # below the entity limit
+
+
+def _histories():
+    """Yield the conference keys of every profile's registrations."""
+    for prof in Profile.query().iter(batch_size=PROFILE_BATCH_SIZE):
+        yield prof.conferenceKeysToAttend
+
+
+def rebuildModel():
+    """Recount co-attendance and topic co-occurrence over all profiles
+    and store the new model; returns it."""
+    today = date.today()
+    conferences, candidates = {}, {}
+    for conf in Conference.query():
+        wsck = conf.key.urlsafe()
+        conferences[wsck] = conf.topics
+        if (not conf.archived and conf.seatsAvailable > 0 and
+                (not conf.startDate or conf.startDate >= today)):
+            candidates[wsck] = [conf.name, conf.city,
+                                str(conf.startDate) if conf.startDate
+                                else None]
+
+    model = buildModel(_histories(), conferences, candidates)
+    data = dumpModel(model)
+    _storeModel(data, model['profiles'])
+    model = loadModel(data)
+    localSet(MODEL_LOCAL_KEY, model, MODEL_LOCAL_TTL)
+    return model
+
+
+@ndb.transactional()
+def _putModel(stored, chunks):
+    """Replace the stored model, dropping chunks it no longer has."""
+    old = stored.key.get()
+    stale = range(len(chunks) + 1, (old.chunks or 0) + 1) if old else []
+    ndb.delete_multi([ndb.Key(RecommendationChunk, n, parent=stored.key)
+                      for n in stale])
+    ndb.put_multi([stored] + [
+        RecommendationChunk(parent=stored.key, id=i + 1, data=chunk)
+        for i, chunk in enumerate(chunks)])
+
+
+def _storeModel(data, profiles):
+    blob = zlib.compress(data)
+    chunks = [blob[i:i + CHUNK_SIZE] for i in range(0, len(blob), CHUNK_SIZE)]
+    logging.info('Storing recommendation model: %d bytes, %d compressed '
+                 'in %d chunks', len(data), len(blob), len(chunks))
+    _putModel(RecommendationModel(id=MODEL_ID, chunks=len(chunks),
+                                  size=len(blob), profiles=profiles), chunks)
+
+
+def _loadModel(stored):
+    """Return the serialized model of stored, or None if a chunk is
+    missing."""
+    if stored.chunks is None:
+        return stored.data
+    found = ndb.get_multi([ndb.Key(RecommendationChunk, i + 1,
+                                   parent=stored.key)
+                           for i in range(stored.chunks)])
+    if None in found:
+        logging.warning('Recommendation model is missing chunks')
+        return None
+    return zlib.decompress(''.join(chunk.data for chunk in found))
+
+
+def getModel():
+    """Return the current model, or None before the first rebuild."""
+    model = localGet(MODEL_LOCAL_KEY)
+    if model is None:
+        stored = ndb.Key(RecommendationModel, MODEL_ID).get()
+        data = _loadModel(stored) if stored else None
+        if not data:
+            return None
+        model = loadModel(data)
+        localSet(MODEL_LOCAL_KEY, model, MODEL_LOCAL_TTL)
+    return model
+
+
+def _recommendations(model, prof):
+    return Recommendations(id=prof.key.id(),
+                           items=recommend(model, prof.conferenceKeysToAttend))
+
+
+def scoreProfiles(cursor=None):
+    """Store recommendations for one page of profiles.
+
+    Returns (profiles scored, next cursor, more).
+    """
+    model = getModel()
+    if not model:
+        # scoring was started without a model, e.g. by hand before the
+        # first rebuild; the next rebuild starts it again
+        logging.warning('No recommendation model to score profiles with')
+        return 0, None, False
+    profiles, next_cursor, more = Profile.query().fetch_page(
+        SCORE_PAGE_SIZE, start_cursor=cursor)
+    ndb.put_multi([_recommendations(model, prof) for prof in profiles])
+    return len(profiles), next_cursor, more
+
+
+def refreshProfile(user_id):
+    """Re-score one profile against the current model."""
+    model = getModel()
+    prof = ndb.Key(Profile, user_id).get()
+    if model and prof:
+        _recommendations(model, prof).put()
+
+
+def refreshLater(prof, conf):
+    """Re-score prof once its (un)registration for conf commits; call
+    inside the transaction writing it, after conf was put."""
+    # conf.revision is new with every write, which names the task uniquely
+    addOutboxTask(prof.key, 'recommend-%d-r%d' % (conf.key.id(),
+                                                  conf.revision),
+                  url='/tasks/refresh_recommendations',
+                  params={'user': prof.key.id()})
+
+
+def getRecommendations(user_id):
+    """Return the recommended conferences of user_id as item dicts.
+
+    Profiles not scored yet get the most attended conferences.
+    """
+    stored = ndb.Key(Recommendations, user_id).get()
+    if stored:
+        return stored.items
+    model = getModel()
+    return recommend(model, []) if model else []
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+"""reconcile.py
+
+Reconciliation of Conference.seatsAvailable with the registrations
+actually stored in Profile.conferenceKeysToAttend.
+
+An audit is a chain of tasks, checkpointed on its SeatAudit entity like
+the mapper jobs, in up to three phases:
+
+- count pages through a projection of Profile.conferenceKeysToAttend --
+  one small index row per registration -- and adds each page to
+  SeatCount children of the audit, one per conference, in the
+  transaction of the checkpoint;
+- check pages through the conferences, compares maxAttendees -
+  seatsAvailable with the counts, recounts each mismatch with an index
+  query and records those that remain as SeatDiscrepancy children;
+- repair, if the audit repairs, pages through the discrepancies.
+
+Registrations made while the audit runs can leave a count stale, and the
+index queries are eventually consistent, so a count may miss a
+registration that already took its seat. A discrepancy is therefore
+only repaired once SETTLE_SECONDS have passed since it was recorded,
+when a second recount gives the same number and the conference is
+still at the revision that was checked: every registration writes the
+conference and so changes its revision, so none has happened since, and
+the index has had time to show the earlier ones. Repairs are written in
+batched cross-group transactions.
+
+"""
+
+import collections
+import logging
+import time
+from datetime import datetime
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from caches import conferenceChanged
+from caches import expireConference
+from models import Conference
+from models import Profile
+from models import SeatAudit
+from models import SeatCount
+from models import SeatDiscrepancy
+from outbox import addOutboxTask
+from outbox import flushOutbox
+
+# registrations per step; each may touch a different SeatCount, all
+# written in the checkpoint's transaction
+COUNT_PAGE_SIZE = 400
+CHECK_PAGE_SIZE = 100
+REPAIR_BATCH_SIZE = 20      # conferences per transaction; xg allows 25
+SETTLE_SECONDS = 30         # for the index to show earlier registrations
+REPORTED = 100              # discrepancies listed by auditStatus
+
+
+def _queueStep(audit_key, number):
+    """Queue step number of an audit; call inside its checkpoint."""
+    addOutboxTask(audit_key, 'step-%d' % number,
+                  url='/crons/reconcile_seats',
+                  params={'audit': str(audit_key.id()),
+                          'step': str(number)})
+
+
+def startAudit(repair):
+    """Start an audit, repairing the discrepancies it finds if repair."""
+    audit = SeatAudit(repair=repair, phase='count')
+
+    @ndb.transactional()
+    def _txn():
+        audit.put()
+        _queueStep(audit.key, 0)
+    _txn()
+    flushOutbox()
+    return audit
+
+
+def _nextPhase(audit):
+    if audit.phase == 'count':
+        return 'check'
+    if audit.phase == 'check' and audit.repair:
+        return 'repair'
+    return 'done'
+
+
+@ndb.transactional()
+def _checkpoint(audit_key, number, cursor, counts=None, checked=0,
+                found=(), repaired=0):
+    """Record a finished step and queue the next one, unless the step
+    was already recorded by an earlier run of the same task."""
+    audit = audit_key.get()
+    if audit.steps != number:
+        return False
+    audit.steps += 1
+    audit.cursor = cursor.urlsafe() if cursor else None
+    if counts:
+        c_keys = [ndb.Key(SeatCount, wsck, parent=audit_key)
+                  for wsck in counts]
+        stored = [seats or SeatCount(key=key) for key, seats in
+                  zip(c_keys, ndb.get_multi(c_keys))]
+        for seats in stored:
+            seats.count += counts[seats.key.id()]
+        ndb.put_multi(stored)
+        audit.registrations += sum(counts.values())
+    audit.checked += checked
+    if found:
+        ndb.put_multi(found)
+        audit.found += len(found)
+    audit.repaired += repaired
+    if not cursor:
+        audit.phase = _nextPhase(audit)
+    audit.put()
+    if audit.phase != 'done':
+        _queueStep(audit_key, audit.steps)
+    return True
+
+
+def _countPage(audit):
+    """Count one page of registrations; returns (cursor or None, counts)."""
+    cursor = Cursor(urlsafe=audit.cursor) if audit.cursor else None
+    rows, next_cursor, more = Profile.query().fetch_page(
+        COUNT_PAGE_SIZE, start_cursor=cursor,
+        projection=[Profile.conferenceKeysToAttend])
+    # a projection on a repeated property returns one row per value
+    counts = collections.Counter(row.conferenceKeysToAttend[0]
+                                 for row in rows)
+    return (next_cursor if more else None), counts
+
+
+def _recount(wsck):
+    """Count the registrations for wsck in the index."""
+    return Profile.query(Profile.conferenceKeysToAttend == wsck).count()
+
+
+def _checkPage(audit):
+    """Compare one page of conferences with the counts; returns (cursor
+    or None, conferences checked, unsaved SeatDiscrepancy entities)."""
+    cursor = Cursor(urlsafe=audit.cursor) if audit.cursor else None
+    confs, next_cursor, more = Conference.query().fetch_page(
+        CHECK_PAGE_SIZE, start_cursor=cursor)
+    counts = ndb.get_multi([ndb.Key(SeatCount, conf.key.urlsafe(),
+                                    parent=audit.key) for conf in confs])
+
+    found = []
+    for conf, seats in zip(confs, counts):
+        wsck = conf.key.urlsafe()
+        taken = (conf.maxAttendees or 0) - (conf.seatsAvailable or 0)
+        if taken == (seats.count if seats else 0):
+            continue
+        # recount, the streamed count may predate recent registrations
+        registered = _recount(wsck)
+        if taken != registered:
+            found.append(SeatDiscrepancy(
+                parent=audit.key, id=wsck, name=conf.name,
+                maxAttendees=conf.maxAttendees,
+                seatsAvailable=conf.seatsAvailable, taken=taken,
+                registered=registered, revision=conf.revision))
+    return (next_cursor if more else None), len(confs), found
+
+
+@ndb.transactional(xg=True)
+def _repair(entries, recounts):
+    """Set seatsAvailable from the recounts of conferences not written
+    since they were checked; returns the conferences repaired."""
+    confs = ndb.get_multi([ndb.Key(urlsafe=entry.key.id())
+                           for entry in entries])
+    repaired = []
+    for conf, entry, registered in zip(confs, entries, recounts):
+        entry.repaired = False
+        if (not conf or conf.revision != entry.revision or
+                registered != entry.registered):
+            continue
+        conf.seatsAvailable = max(0, (conf.maxAttendees or 0) - registered)
+        entry.repaired = True
+        repaired.append(conf)
+    ndb.put_multi(repaired + [entry for entry in entries if entry.repaired])
+    for conf in repaired:
+        expireConference(conf.key.urlsafe())
+    return repaired
+
+
+def _repairPage(audit):
+    """Repair one batch of discrepancies whose counts settled; returns
+    (cursor or None, conferences repaired)."""
+    cursor = Cursor(urlsafe=audit.cursor) if audit.cursor else None
+    entries, next_cursor, more = SeatDiscrepancy.query(
+        ancestor=audit.key).fetch_page(REPAIR_BATCH_SIZE,
+                                       start_cursor=cursor)
+    entries = [entry for entry in entries if not entry.repaired]
+    if entries:
+        # the batch was recorded moments ago at the end of the check
+        # phase at worst, so waiting here is short
+        newest = max(entry.checked for entry in entries)
+        wait = SETTLE_SECONDS - (datetime.now() - newest).total_seconds()
+        if wait > 0:
+            time.sleep(wait)
+    recounts = [_recount(entry.key.id()) for entry in entries]
+    repaired = _repair(entries, recounts) if entries else []
+    for conf in repaired:
+        conferenceChanged(conf.key.urlsafe(), set(['seatsAvailable']))
+    return (next_cursor if more else None), len(repaired)
+
+
+def runStep(audit_id, number):
+    """Run the next step of an audit."""
+    audit = ndb.Key(SeatAudit, audit_id).get()
+    if not audit or audit.phase == 'done' or audit.steps != number:
+        logging.info('Dropping stale step %d of seat audit %d', number,
+                     audit_id)
+        return
+
+    if audit.phase == 'count':
+        cursor, counts = _countPage(audit)
+        recorded = _checkpoint(audit.key, number, cursor, counts=counts)
+    elif audit.phase == 'check':
+        cursor, checked, found = _checkPage(audit)
+        for entry in found:
+            logging.warning('Seat count of %s (%s): %d seats taken, %d '
+                            'registered', entry.name, entry.key.id(),
+                            entry.taken, entry.registered)
+        recorded = _checkpoint(audit.key, number, cursor, checked=checked,
+                               found=found)
+    else:
+        cursor, repaired = _repairPage(audit)
+        recorded = _checkpoint(audit.key, number, cursor, repaired=repaired)
+    if recorded:
+        flushOutbox()
+
+
+def auditStatus(audit_id):
+    """Return the progress and findings of an audit as a dict, or None."""
+    audit = ndb.Key(SeatAudit, audit_id).get()
+    if not audit:
+        return None
+    return {
+        'audit': audit_id,
+        'repair': audit.repair,
+        'phase': audit.phase,
+        'started': audit.started.isoformat(),
+        'elapsedSeconds': round(
+            (audit.updated - audit.started).total_seconds(), 1),
+        'registrations': audit.registrations,
+        'checked': audit.checked,
+        'found': audit.found,
+        'repaired': audit.repaired,
+        'discrepancies': [{
+            'websafeKey': entry.key.id(), 'name': entry.name,
+            'maxAttendees': entry.maxAttendees,
+            'seatsAvailable': entry.seatsAvailable, 'taken': entry.taken,
+            'registered': entry.registered, 'repaired': entry.repaired,
+        } for entry in SeatDiscrepancy.query(ancestor=audit.key).fetch(
+            REPORTED)],
+    }
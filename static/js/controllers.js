@@ -249,7 +249,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, $http, oauth2Provider, HTTP_ERRORS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -424,7 +424,90 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Invokes the conference.queryConferences API.
+     * Conference properties of the filterable fields.
+     */
+    var CATALOG_FIELDS = {
+        'CITY': 'city',
+        'TOPIC': 'topics',
+        'MONTH': 'month',
+        'MAX_ATTENDEES': 'maxAttendees'
+    };
+
+    /**
+     * Compares a conference value with a filter value like the datastore does.
+     *
+     * @param value the conference value
+     * @param operator the operator enumValue
+     * @param target the filter value
+     * @returns {boolean}
+     */
+    var matches = function (value, operator, target) {
+        if (angular.isArray(value)) {
+            // repeated properties match if any of their values does
+            for (var i = 0; i < value.length; i++) {
+                if (matches(value[i], operator, target)) {
+                    return true;
+                }
+            }
+            return false;
+        }
+        switch (operator) {
+            case 'EQ': return value == target;
+            case 'NE': return value != target;
+            case 'GT': return value > target;
+            case 'GTEQ': return value >= target;
+            case 'LT': return value < target;
+            case 'LTEQ': return value <= target;
+        }
+        return false;
+    };
+
+    /**
+     * Applies the filters to the public catalog snapshot, ordered like queryConferences:
+     * by the inequality field if there is one, then by name.
+     *
+     * @param catalog the catalog snapshot ({fields: [...], rows: [[...]]})
+     * @param filters the filters as sent to queryConferences
+     * @returns {Array} the matching conferences
+     */
+    var filterCatalog = function (catalog, filters) {
+        var inequalityField = null;
+        angular.forEach(filters, function (filter) {
+            if (filter.operator != 'EQ') {
+                inequalityField = CATALOG_FIELDS[filter.field];
+            }
+        });
+        var conferences = [];
+        angular.forEach(catalog.rows, function (row) {
+            var conference = {};
+            for (var i = 0; i < catalog.fields.length; i++) {
+                conference[catalog.fields[i]] = row[i];
+            }
+            for (var j = 0; j < filters.length; j++) {
+                var field = CATALOG_FIELDS[filters[j].field];
+                var target = filters[j].value;
+                if (field == 'month' || field == 'maxAttendees') {
+                    target = parseInt(target, 10);
+                }
+                if (!matches(conference[field], filters[j].operator, target)) {
+                    return;
+                }
+            }
+            conferences.push(conference);
+        });
+        conferences.sort(function (a, b) {
+            if (inequalityField && a[inequalityField] != b[inequalityField]) {
+                return a[inequalityField] < b[inequalityField] ? -1 : 1;
+            }
+            return a.name < b.name ? -1 : (a.name > b.name ? 1 : 0);
+        });
+        return conferences;
+    };
+
+    /**
+     * Shows the conferences in the public catalog snapshot that match the filters; the
+     * snapshot is served with an ETag, so the browser only downloads new generations.
+     * Falls back to the conference.queryConferences API if the snapshot is unavailable.
      */
     $scope.queryConferencesAll = function () {
         var sendFilters = {
@@ -441,6 +524,27 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
             }
         }
         $scope.loading = true;
+        $http.get('/fast/catalog').
+            success(function (catalog) {
+                $scope.loading = false;
+                $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
+                $scope.alertStatus = 'success';
+                $log.info($scope.messages + ' (catalog generation ' + catalog.generation + ')');
+                $scope.conferences = filterCatalog(catalog, sendFilters.filters);
+                $scope.submitted = true;
+            }).
+            error(function () {
+                $log.info('Catalog unavailable, querying conferences');
+                $scope.queryConferencesLive(sendFilters);
+            });
+    };
+
+    /**
+     * Invokes the conference.queryConferences API.
+     *
+     * @param sendFilters the filters as sent to queryConferences
+     */
+    $scope.queryConferencesLive = function (sendFilters) {
         gapi.client.conference.queryConferences(sendFilters).
             execute(function (resp) {
                 $scope.$apply(function () {
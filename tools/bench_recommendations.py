@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""bench_recommendations.py -- time the recommendation job offline
+
+Builds the cooccurrence.py model from a synthetic dataset (profiles
+registering for a few conferences each, popularity and topics skewed
+like real traffic) and scores every profile, reporting the runtime of
+both phases, the stored model size and the peak memory. Profiles are
+generated on the fly, as the job streams them from the datastore.
+
+usage: python tools/bench_recommendations.py [--profiles 100000]
+           [--conferences 2000] [--topics 40] [--registrations 3]
+
+"""
+
+import optparse
+import os
+import random
+import resource
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cooccurrence import buildModel
+from cooccurrence import dumpModel
+from cooccurrence import loadModel
+from cooccurrence import recommend
+
+
+def peakMemory():
+    """Peak resident set size of this process so far, in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def conferences(count, topics, seed):
+    """Return ({key: topics}, {key: info}) for count conferences, a
+    quarter of them recommendable."""
+    rand = random.Random(seed)
+    names = ['topic%d' % i for i in range(topics)]
+    confs, candidates = {}, {}
+    for i in range(count):
+        key = 'conference%06d' % i
+        confs[key] = rand.sample(names, rand.randint(1, 3))
+        if i % 4 == 0:
+            candidates[key] = ['Conference %d' % i, 'City %d' % (i % 50),
+                               '2026-11-01']
+    return confs, candidates
+
+
+def histories(profiles, keys, registrations, seed):
+    """Yield each synthetic profile's registrations, skewed towards the
+    popular conferences."""
+    rand = random.Random(seed)
+    for _ in range(profiles):
+        count = min(int(rand.expovariate(1.0 / registrations)) + 1, 30)
+        yield [keys[min(int(rand.paretovariate(1.2)) - 1, len(keys) - 1)
+                    if rand.random() < 0.5 else rand.randrange(len(keys))]
+               for _ in range(count)]
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--profiles', type='int', default=100000)
+    parser.add_option('--conferences', type='int', default=2000)
+    parser.add_option('--topics', type='int', default=40)
+    parser.add_option('--registrations', type='int', default=3,
+                      help='mean registrations per profile')
+    parser.add_option('--seed', type='int', default=1)
+    opts, _ = parser.parse_args()
+
+    confs, candidates = conferences(opts.conferences, opts.topics, opts.seed)
+    keys = sorted(confs)
+    print('%d profiles, %d conferences (%d recommendable), %d topics' % (
+        opts.profiles, len(confs), len(candidates), opts.topics))
+    print('baseline                 %8.1f MB peak' % peakMemory())
+
+    began = time.time()
+    model = buildModel(histories(opts.profiles, keys, opts.registrations,
+                                 opts.seed), confs, candidates)
+    data = dumpModel(model)
+    print('build model  %8.1f s   %8.1f MB peak' % (time.time() - began,
+                                                     peakMemory()))
+    print('model        %8d KB json, %d KB compressed' % (
+        len(data) / 1024, len(zlib.compress(data.encode('utf-8'))) / 1024))
+
+    model = loadModel(data)
+    began = time.time()
+    scored = 0
+    for history in histories(opts.profiles, keys, opts.registrations,
+                              opts.seed):
+        recommend(model, history)
+        scored += 1
+    elapsed = time.time() - began
+    print('score all    %8.1f s   %8.1f MB peak   %.0f profiles/s' % (
+        elapsed, peakMemory(), scored / elapsed))
+
+
+if __name__ == '__main__':
+    main()
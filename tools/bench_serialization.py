@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""bench_serialization.py -- compare list response encoding paths
+
+Encodes N synthetic conferences (and sessions) the way the endpoints
+path does (ConferenceForm per row + protojson) and the way fastjson.py
+does, with a cold and a warm fragment cache. Needs the App Engine
+Python SDK.
+
+usage: python tools/bench_serialization.py --sdk /path/to/google_appengine
+           [--rows 1000] [--repeat 5]
+
+"""
+
+import datetime
+import optparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def best(func, repeat):
+    """Return the best wall time of repeat runs of func, in ms."""
+    times = []
+    for _ in range(repeat):
+        began = time.time()
+        func()
+        times.append(time.time() - began)
+    return min(times) * 1000
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--sdk', help='path to the App Engine Python SDK')
+    parser.add_option('--rows', type='int', default=1000)
+    parser.add_option('--repeat', type='int', default=5)
+    opts, _ = parser.parse_args()
+    if not opts.sdk:
+        parser.error('--sdk is required')
+
+    sys.path.insert(0, opts.sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+
+    from google.appengine.ext import ndb
+    from google.appengine.ext import testbed
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+
+    from protorpc import protojson
+    import conference
+    import fastjson
+    from models import Conference
+    from models import ConferenceForms
+    from models import Profile
+
+    api = conference.ConferenceApi()
+    start = datetime.date(2016, 6, 1)
+    confs = []
+    for i in range(opts.rows):
+        conf = Conference(
+            key=ndb.Key(Profile, 'user%d@example.com' % (i % 50),
+                        Conference, i + 1),
+            name='Conference %d' % i, description='About conference %d' % i,
+            organizerUserId='user%d@example.com' % (i % 50),
+            topics=['Web Technologies', 'Programming Languages'],
+            city='London', startDate=start, month=6, endDate=start,
+            maxAttendees=100, seatsAvailable=i % 100, version=1)
+        confs.append(conf)
+    names = dict(('user%d@example.com' % i, 'User %d' % i)
+                 for i in range(50))
+
+    def messagesPath():
+        return protojson.encode_message(ConferenceForms(items=[
+            api._copyConferenceToForm(conf, names[conf.organizerUserId])
+            for conf in confs]))
+
+    def fastCold():
+        fastjson._fragments.clear()
+        return fastjson.encodeConferences(confs, names)
+
+    def fastWarm():
+        return fastjson.encodeConferences(confs, names)
+
+    fastWarm()
+    print('%d conferences, best of %d' % (opts.rows, opts.repeat))
+    for label, func in [('ConferenceForm + protojson', messagesPath),
+                        ('fastjson, cold cache', fastCold),
+                        ('fastjson, warm cache', fastWarm)]:
+        print('  %-28s %8.1f ms' % (label, best(func, opts.repeat)))
+
+    bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+"""build_assets.py -- bundle, minify and fingerprint the web client
+
+Reads templates/index.html, replaces every
+    <!-- build:css NAME --> ... <!-- endbuild -->
+    <!-- build:js NAME --> ... <!-- endbuild -->
+block with a single tag for the concatenated, minified bundle of the local
+files it references, and writes the page to static/build/index.html. The
+Angular partials are put into $templateCache inside the JS bundle, so
+routes and modals need no extra request. Bundles are named after a hash
+of their content so app.yaml can serve /build with far-future expiry.
+
+Run it after changing anything under static/ or templates/, and commit
+the output.
+
+usage: python tools/build_assets.py
+
+"""
+
+import glob
+import hashlib
+import json
+import os
+import re
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE = os.path.join(ROOT, 'templates', 'index.html')
+BUILD_DIR = os.path.join(ROOT, 'static', 'build')
+BUILD_URL = '/build/'
+# URL prefixes as mapped by the static_dir handlers in app.yaml
+STATIC_DIRS = {
+    '/css/': os.path.join(ROOT, 'static', 'bootstrap', 'css'),
+    '/js/': os.path.join(ROOT, 'static', 'js'),
+}
+PARTIALS = os.path.join(ROOT, 'static', 'partials', '*.html')
+PARTIALS_URL = '/partials/'
+# the bundle module that owns $templateCache entries
+TEMPLATE_MODULE = 'conferenceApp'
+
+BLOCK_RE = re.compile(r'[ \t]*<!-- build:(css|js) (\S+) -->(.*?)<!-- endbuild -->',
+                      re.S)
+REF_RE = re.compile(r'(?:href|src)="([^"]+)"')
+TEMPLATES_TPL = ("angular.module(%s).run(['$templateCache', "
+                 "function ($templateCache) {\n%s\n}]);\n")
+
+
+def localPath(url):
+    for prefix, directory in STATIC_DIRS.items():
+        if url.startswith(prefix):
+            return os.path.join(directory, url[len(prefix):])
+    raise ValueError('%s is not served from a static directory' % url)
+
+
+def _split(source, line_comments):
+    """Yield (is_code, text) chunks with comments dropped and quoted
+    strings kept intact."""
+    chunk, i, n = [], 0, len(source)
+    while i < n:
+        c, pair = source[i], source[i:i + 2]
+        if c in '"\'':
+            if chunk:
+                yield True, ''.join(chunk)
+                chunk = []
+            j = i + 1
+            while j < n and source[j] != c:
+                j += 2 if source[j] == '\\' else 1
+            yield False, source[i:j + 1]
+            i = j + 1
+        elif pair == '/*':
+            end = source.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+        elif line_comments and pair == '//':
+            end = source.find('\n', i)
+            i = n if end < 0 else end
+        else:
+            chunk.append(c)
+            i += 1
+    if chunk:
+        yield True, ''.join(chunk)
+
+
+def minifyCss(source):
+    """Strip comments and redundant whitespace from CSS."""
+    out = []
+    for is_code, text in _split(source, False):
+        if is_code:
+            text = re.sub(r'\s+', ' ', text)
+            text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+            text = re.sub(r':\s+', ':', text)
+            text = text.replace(';}', '}')
+        out.append(text)
+    return ''.join(out).strip() + '\n'
+
+
+def minifyJs(source):
+    """Strip comments, indentation and blank lines from JS.
+
+    Line breaks are kept so automatic semicolon insertion still applies;
+    identifiers are left alone since Angular injects by parameter name.
+    The sources contain no regular expression literals, which this
+    scanner would not recognise.
+    """
+    text = ''.join(text for _, text in _split(source, True))
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line) + '\n'
+
+
+def templateCache():
+    """Return JS putting every partial into $templateCache."""
+    puts = []
+    for path in sorted(glob.glob(PARTIALS)):
+        with open(path) as f:
+            html = '\n'.join(line.strip() for line in f.read().splitlines())
+        puts.append('$templateCache.put(%s, %s);' % (
+            json.dumps(PARTIALS_URL + os.path.basename(path)),
+            json.dumps(html.strip())))
+    return TEMPLATES_TPL % (json.dumps(TEMPLATE_MODULE), '\n'.join(puts))
+
+
+def writeBundle(kind, name, urls):
+    """Write the fingerprinted bundle and return its URL."""
+    parts = []
+    for url in urls:
+        with open(localPath(url)) as f:
+            parts.append(f.read())
+    if kind == 'css':
+        content = minifyCss('\n'.join(parts))
+    else:
+        # app.js defines the module, so the templates follow it
+        parts.insert(1, templateCache())
+        content = ''.join(minifyJs(part) for part in parts)
+
+    base, ext = os.path.splitext(name)
+    digest = hashlib.md5(content.encode('utf-8')).hexdigest()[:10]
+    filename = '%s.%s%s' % (base, digest, ext)
+    for stale in glob.glob(os.path.join(BUILD_DIR, '%s.*%s' % (base, ext))):
+        os.remove(stale)
+    with open(os.path.join(BUILD_DIR, filename), 'w') as f:
+        f.write(content)
+    print('%-24s %7d bytes from %d files (%d bytes)' % (
+        filename, len(content), len(urls), sum(len(p) for p in parts)))
+    return BUILD_URL + filename
+
+
+def main():
+    if not os.path.isdir(BUILD_DIR):
+        os.makedirs(BUILD_DIR)
+    with open(SOURCE) as f:
+        page = f.read()
+
+    def replace(match):
+        kind, name, block = match.groups()
+        indent = match.group(0)[:len(match.group(0)) -
+                                len(match.group(0).lstrip())]
+        url = writeBundle(kind, name, REF_RE.findall(block))
+        if kind == 'css':
+            return '%s<link rel="stylesheet" href="%s">' % (indent, url)
+        return '%s<script src="%s"></script>' % (indent, url)
+
+    with open(os.path.join(BUILD_DIR, 'index.html'), 'w') as f:
+        f.write(BLOCK_RE.sub(replace, page))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""index_minimizer.py -- derive the minimal Conference indexes
+
+Reads the query shapes queryConferences() actually served (the
+"Conference query shape:" lines it logs, e.g. from
+`appcfg.py request_logs`), or enumerates every possible shape when no
+log is given, and prints the smallest set of merge-join indexes that
+serves them together with a per-put write cost estimate against the
+current index.yaml.
+
+By default shapes with an inequality get composite indexes too;
+--no-inequality leaves them to the in-memory fallback of
+_fetchConferences, as the committed index.yaml does. --write replaces
+only the Conference entries of the file it is given and keeps every
+other kind's, so the committed index.yaml is regenerated with
+
+    python tools/index_minimizer.py --no-inequality --write index.yaml
+
+usage: python tools/index_minimizer.py [--log FILE] [--no-inequality]
+           [--topics N] [--write index.yaml]
+
+"""
+
+import optparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import indexes
+
+KIND = 'Conference'
+FILTER_FIELDS = ['city', 'topics', 'month', 'maxAttendees']
+# equality filters queryConferences() adds by default (includeArchived
+# turns them off)
+DEFAULT_EQUALITIES = ('archived',)
+# Conference indexes used outside queryConferences(): the announcement
+# and the archival cron
+FIXED_INDEXES = [('archived', 'seatsAvailable', 'name'),
+                 ('archived', 'endDate')]
+COMMENTS = {
+    ('archived', 'seatsAvailable', 'name'):
+        'announcement: nearly sold out, unarchived conferences',
+    ('archived', 'endDate'): 'archival cron: ended, unarchived conferences',
+}
+INDEXED_PROPERTIES = ['name', 'description', 'organizerUserId', 'topics',
+                      'city', 'startDate', 'month', 'endDate', 'maxAttendees',
+                      'seatsAvailable', 'archived']
+
+
+def readShapes(path):
+    """Return the distinct shapes logged in path."""
+    shapes = set()
+    with open(path) as log:
+        for line in log:
+            shape = indexes.parseShape(line)
+            if shape:
+                shapes.add(shape)
+    return sorted(shapes, key=lambda shape: (shape[0], shape[1] or ''))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--log', help='request log with logged query shapes')
+    parser.add_option('--no-inequality', action='store_true', default=False,
+                      help='serve inequality shapes from the in-memory '
+                           'fallback instead of composite indexes')
+    parser.add_option('--topics', type='float', default=2,
+                      help='average number of topics per conference')
+    parser.add_option('--index-yaml', default=os.path.join(ROOT, 'index.yaml'))
+    parser.add_option('--write', help='replace the Conference indexes of '
+                                      'this index.yaml (created if missing)')
+    opts, _ = parser.parse_args()
+
+    if opts.log:
+        shapes = readShapes(opts.log)
+    else:
+        shapes = indexes.allShapes(FILTER_FIELDS)
+        shapes += [(tuple(sorted(equalities + DEFAULT_EQUALITIES)), inequality)
+                   for equalities, inequality in shapes]
+    with open(opts.index_yaml) as f:
+        current = indexes.parseIndexYaml(f.read(), KIND)
+    minimal = indexes.minimalIndexes(
+        shapes, inequality_composites=not opts.no_inequality)
+    minimal += [props for props in FIXED_INDEXES if props not in minimal]
+
+    values = {'topics': opts.topics}
+    current_cost = indexes.writeCost(current, INDEXED_PROPERTIES, values)
+    minimal_cost = indexes.writeCost(minimal, INDEXED_PROPERTIES, values)
+
+    sys.stderr.write('query shapes:          %d\n' % len(shapes))
+    sys.stderr.write('current composites:    %d (%.1f write ops per put)\n'
+                     % (len(current), current_cost))
+    sys.stderr.write('minimal composites:    %d (%.1f write ops per put)\n'
+                     % (len(minimal), minimal_cost))
+
+    if opts.write:
+        text = 'indexes:\n\n'
+        if os.path.exists(opts.write):
+            with open(opts.write) as f:
+                text = f.read()
+        with open(opts.write, 'w') as f:
+            f.write(indexes.mergeIndexYaml(text, KIND, minimal, COMMENTS))
+    else:
+        sys.stdout.write(indexes.formatIndexYaml(KIND, minimal, COMMENTS))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""mail_sink.py -- measure confirmation digest throughput locally
+
+Feeds synthetic confirmation tasks through the same grouping and
+formatting as the digest cron into a stub mail sink, and compares the
+number of mail API calls with one mail per created conference.
+
+usage: python tools/mail_sink.py [--tasks N] [--recipients N]
+
+"""
+
+import collections
+import datetime
+import optparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import digests
+
+Task = collections.namedtuple('Task', 'payload')
+Conf = collections.namedtuple('Conf', 'name city startDate endDate')
+
+
+class StubMailSink(object):
+    """Stands in for mail.send_mail, counting calls and bytes."""
+
+    def __init__(self):
+        self.mails = 0
+        self.bytes = 0
+
+    def send_mail(self, sender, to, subject, body):
+        self.mails += 1
+        self.bytes += len(sender) + len(to) + len(subject) + len(body)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--tasks', type='int', default=100000)
+    parser.add_option('--recipients', type='int', default=50)
+    opts, _ = parser.parse_args()
+
+    rnd = random.Random(0)
+    start = datetime.date(2016, 1, 1)
+    confs = {}
+    tasks = []
+    for i in range(opts.tasks):
+        wsck = 'conf%d' % i
+        confs[wsck] = Conf('Conference %d' % i, 'London', start, start)
+        email = 'user%d@example.com' % rnd.randrange(opts.recipients)
+        tasks.append(Task(digests.confirmationPayload(email, wsck)))
+
+    sink = StubMailSink()
+    began = time.time()
+    # like lease_tasks_by_tag: every task of the oldest task's recipient,
+    # DIGEST_BATCH_SIZE at most per lease
+    for email, entries in digests.groupByRecipient(tasks).items():
+        for i in range(0, len(entries), digests.DIGEST_BATCH_SIZE):
+            subject, body = digests.formatDigest(
+                [confs[wsck] for _, wsck
+                 in entries[i:i + digests.DIGEST_BATCH_SIZE]])
+            sink.send_mail('noreply@example.com', email, subject, body)
+    elapsed = time.time() - began
+
+    print('tasks:            %d' % len(tasks))
+    print('mails (digest):   %d' % sink.mails)
+    print('mails (per task): %d' % len(tasks))
+    print('payload bytes:    %.1f per task' % (
+        sum(len(t.payload) for t in tasks) / float(len(tasks))))
+    print('throughput:       %.0f tasks/s, %.0f mails/s' % (
+        len(tasks) / elapsed, sink.mails / elapsed))
+    print('cron runs needed: %d at %d mails per run' % (
+        -(-sink.mails // digests.DIGEST_MAX_MAILS_PER_RUN),
+        digests.DIGEST_MAX_MAILS_PER_RUN))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""startup_profile.py -- measure cold-start cost locally
+
+Imports each application module in a fresh interpreter state and reports
+how long it took, then replays a first request against main.app (warmup,
+then the announcement cron) on testbed stubs and reports its latency.
+Needs the App Engine Python SDK.
+
+usage: python tools/startup_profile.py --sdk /path/to/google_appengine
+
+"""
+
+import optparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ['models', 'caches', 'main', 'conference']
+
+
+def timeImport(name):
+    """Import name from scratch and return the seconds it took."""
+    for loaded in list(sys.modules):
+        if loaded in MODULES or loaded.startswith('endpoints'):
+            del sys.modules[loaded]
+    began = time.time()
+    __import__(name)
+    return time.time() - began
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--sdk', help='path to the App Engine Python SDK')
+    opts, _ = parser.parse_args()
+    if not opts.sdk:
+        parser.error('--sdk is required')
+
+    sys.path.insert(0, opts.sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+
+    from google.appengine.ext import testbed
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+    bed.init_app_identity_stub()
+
+    for name in MODULES:
+        print('import %-12s %7.1f ms' % (name, timeImport(name) * 1000))
+
+    import main as app_main
+    import webapp2
+    for path in ['/_ah/warmup', '/crons/set_announcement']:
+        began = time.time()
+        response = webapp2.Request.blank(path).get_response(app_main.app)
+        print('first %-24s %7.1f ms (%s)' % (
+            path, (time.time() - began) * 1000, response.status_int))
+
+    bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
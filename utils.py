@@ -1,9 +1,9 @@
+import heapq
 import json
 import os
 import time
 import uuid
 
-from google.appengine.api import urlfetch
 from models import Profile
 
 def getUserId(user, id_type="email"):
@@ -12,6 +12,8 @@ def getUserId(user, id_type="email"):
 
     if id_type == "oauth":
         """A workaround implementation for getting userid."""
+        # only this rarely used path needs urlfetch; import it lazily
+        from google.appengine.api import urlfetch
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
         token_type = 'id_token'
@@ -43,3 +45,24 @@ def getUserId(user, id_type="email"):
             return profile.id()
         else:
             return str(uuid.uuid1().get_hex())
+
+
+def findConflicts(intervals):
+    """Sweep-line over (id, start, end) intervals sorted by start.
+
+    Returns {id: [ids of overlapping intervals]}; intervals without a
+    start never conflict. Touching intervals (one ends as the next
+    starts) do not overlap.
+    """
+    conflicts = {}
+    active = []     # heap of (end, id) still running at the sweep point
+    for ident, start, end in intervals:
+        if start is None:
+            continue
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for _, other in active:
+            conflicts.setdefault(ident, []).append(other)
+            conflicts.setdefault(other, []).append(ident)
+        heapq.heappush(active, (end or start, ident))
+    return conflicts